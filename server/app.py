@@ -24,6 +24,13 @@ def create_app() -> Flask:
     # Database
     app.config["SQLALCHEMY_DATABASE_URI"] = config.DATABASE_URL
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    # The server is threaded and parse jobs run their own worker threads, so
+    # keep enough pooled connections around to avoid reconnecting under load.
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        "pool_size": config.DB_POOL_SIZE,
+        "max_overflow": config.DB_MAX_OVERFLOW,
+        "pool_recycle": config.DB_POOL_RECYCLE,
+    }
 
     # JWT
     app.config["JWT_SECRET_KEY"] = config.JWT_SECRET_KEY
@@ -56,12 +63,25 @@ def create_app() -> Flask:
     from routes import register_routes
     register_routes(app)
 
+    _init_storage()
+
     with app.app_context():
         _auto_extract_pending()
 
     return app
 
 
+def _init_storage():
+    """Create Minio buckets up front; if Minio is not up yet, the first
+    storage call retries."""
+    import storage
+
+    try:
+        storage.init_storage()
+    except Exception as e:
+        print(f"Warning: Could not initialize Minio buckets ({e}). Will retry on first use.")
+
+
 def _auto_extract_pending():
     """Auto-extract uploads that are parsed but have no extraction yet."""
     from sqlalchemy.exc import ProgrammingError, OperationalError
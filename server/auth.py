@@ -1,5 +1,7 @@
 from __future__ import annotations
 
+import threading
+import time
 from functools import wraps
 
 from flask import g, jsonify, request
@@ -8,6 +10,12 @@ from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
 from extensions import db
 from models import User, WorkspaceMember
 
+# User ids recently confirmed to exist, for endpoints that only need a yes/no
+# (the status stream is re-opened on every reconnect and page reload).
+USER_EXISTS_TTL = 60.0
+_user_seen: dict[str, float] = {}
+_user_seen_lock = threading.Lock()
+
 
 def auth_required(fn):
     """Decorator: requires valid JWT access token, sets g.current_user."""
@@ -52,6 +60,42 @@ def workspace_required(fn):
     return wrapper
 
 
+def upload_required(fn):
+    """Decorator: requires the <uid> upload to exist in g.workspace, sets g.upload.
+
+    Stack it under @workspace_required.
+    """
+    @wraps(fn)
+    def wrapper(uid, *args, **kwargs):
+        from db import db_get
+
+        u = getattr(g, "upload", None)
+        if u is None or u.get("id") != uid:
+            u = db_get(uid)
+        if not u or u.get("workspace_id") != g.workspace.id:
+            return jsonify({"error": "Not found"}), 404
+        g.upload = u
+        return fn(uid, *args, **kwargs)
+    return wrapper
+
+
+def user_exists(user_id: str) -> bool:
+    """Whether a user with this id exists; positive answers are cached for USER_EXISTS_TTL."""
+    now = time.monotonic()
+    with _user_seen_lock:
+        expires = _user_seen.get(user_id)
+        if expires is not None and expires > now:
+            return True
+    if db.session.get(User, user_id) is None:
+        return False
+    with _user_seen_lock:
+        if len(_user_seen) >= 1024:
+            for k in [k for k, v in _user_seen.items() if v <= now]:
+                del _user_seen[k]
+        _user_seen[user_id] = now + USER_EXISTS_TTL
+    return True
+
+
 def get_current_user() -> User | None:
     """Get the current user from g, or None if not authenticated."""
     return getattr(g, "current_user", None)
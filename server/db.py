@@ -1,5 +1,13 @@
 from __future__ import annotations
 
+import threading
+import time
+from collections.abc import Iterator
+
+from sqlalchemy import func, text
+from sqlalchemy.orm import undefer
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
 from extensions import db
 from models import Upload, Page, Schema as SchemaModel
 
@@ -11,6 +19,35 @@ def init_db():
 
 # ---------- Upload helpers ----------
 
+# Per-upload change counters, bumped after every committed write to an upload
+# row so status streams can wait for a change instead of polling the DB.
+_upload_versions: dict[str, int] = {}
+_upload_changed = threading.Condition()
+
+
+def _notify_upload_changed(uid: str):
+    with _upload_changed:
+        _upload_versions[uid] = _upload_versions.get(uid, 0) + 1
+        _upload_changed.notify_all()
+
+
+def db_upload_version(uid: str) -> int:
+    """Current change counter for an upload (see db_wait_upload_change)."""
+    with _upload_changed:
+        return _upload_versions.get(uid, 0)
+
+
+def db_wait_upload_change(uid: str, seen: int, timeout: float) -> int:
+    """Block until the upload changes after version `seen`, or timeout.
+
+    Returns the current version. Only writes made by this process notify, so
+    callers should still re-read after a timeout.
+    """
+    with _upload_changed:
+        _upload_changed.wait_for(lambda: _upload_versions.get(uid, 0) != seen, timeout)
+        return _upload_versions.get(uid, 0)
+
+
 def _upload_to_dict(u: Upload) -> dict:
     return {
         "id": u.id,
@@ -49,6 +86,7 @@ def db_update(uid: str, **kw):
         for k, v in kw.items():
             setattr(u, k, v)
         db.session.commit()
+        _notify_upload_changed(uid)
 
 
 def db_create_upload(
@@ -87,6 +125,10 @@ def db_delete_upload(uid: str):
     if u:
         db.session.delete(u)
         db.session.commit()
+        with _upload_changed:
+            # Wakes status streams waiting on it; they re-read and find it gone
+            _upload_versions.pop(uid, None)
+            _upload_changed.notify_all()
 
 
 def db_list_uploads_by_company_state(
@@ -115,12 +157,21 @@ def _page_to_dict(p: Page) -> dict:
         "markdown": p.markdown,
         "state": p.state,
         "error": p.error,
+        "updated_at": p.updated_at.isoformat() if p.updated_at else None,
     }
 
 
-def db_get_page(uid: str, page_num: int) -> dict | None:
-    p = db.session.get(Page, (uid, page_num))
-    return _page_to_dict(p) if p else None
+def db_get_page(uid: str, page_num: int, with_tables: bool = False) -> dict | None:
+    """Get one page. with_tables also loads the stored tables (None if unset)."""
+    if not with_tables:
+        p = db.session.get(Page, (uid, page_num))
+        return _page_to_dict(p) if p else None
+    p = db.session.get(Page, (uid, page_num), options=[undefer(Page.tables)])
+    if not p:
+        return None
+    d = _page_to_dict(p)
+    d["tables"] = p.tables
+    return d
 
 
 def db_page_states(uid: str) -> list[dict]:
@@ -134,37 +185,89 @@ def db_page_states(uid: str) -> list[dict]:
 
 def db_create_pages(uid: str, page_nums: list[int]):
     """Bulk create page records (skips if already exists)."""
-    for pn in page_nums:
-        existing = db.session.get(Page, (uid, pn))
-        if not existing:
-            db.session.add(Page(upload_id=uid, page_num=pn, state="pending"))
+    if not page_nums:
+        return
+    # One batched INSERT ... ON CONFLICT DO NOTHING instead of a lookup and
+    # insert per page
+    stmt = pg_insert(Page).on_conflict_do_nothing(index_elements=["upload_id", "page_num"])
+    db.session.execute(stmt, [
+        {"upload_id": uid, "page_num": pn, "state": "pending"} for pn in page_nums
+    ])
     db.session.commit()
 
 
 def db_get_parsed_pages(uid: str) -> list[dict]:
-    """Get all done pages for an upload, ordered by page_num."""
+    """Get all done pages for an upload, ordered by page_num.
+
+    Stored tables are included (None if unset).
+    """
     pages = (
         Page.query.filter_by(upload_id=uid, state="done")
+        .options(undefer(Page.tables))
         .order_by(Page.page_num)
         .all()
     )
-    return [{"page_num": p.page_num, "markdown": p.markdown} for p in pages]
+    return [{"page_num": p.page_num, "markdown": p.markdown, "tables": p.tables} for p in pages]
+
+
+def db_iter_parsed_pages(uid: str, batch_size: int = 50) -> Iterator[tuple[int, str]]:
+    """Yield (page_num, markdown) for an upload's done pages, fetched in batches."""
+    query = (
+        db.session.query(Page.page_num, Page.markdown)
+        .filter(Page.upload_id == uid, Page.state == "done")
+        .order_by(Page.page_num)
+        .yield_per(batch_size)
+    )
+    for page_num, markdown in query:
+        yield page_num, markdown
+
+
+def db_parsed_pages_version(uid: str) -> tuple:
+    """Cheap fingerprint of an upload's done pages (count, last page, last edit).
+
+    Changes whenever a page finishes parsing, is reset, or has its markdown
+    edited, so it can key caches of data derived from db_get_parsed_pages.
+    """
+    row = (
+        db.session.query(
+            func.count(Page.page_num),
+            func.max(Page.page_num),
+            func.max(Page.updated_at),
+        )
+        .filter(Page.upload_id == uid, Page.state == "done")
+        .one()
+    )
+    return tuple(row)
 
 
 def db_update_page(uid: str, page_num: int, **kw):
     p = db.session.get(Page, (uid, page_num))
     if p:
+        if "markdown" in kw:
+            # Stored tables describe the old markdown
+            kw.setdefault("tables", None)
         for k, v in kw.items():
             setattr(p, k, v)
         db.session.commit()
 
 
-def db_update_page_done(uid: str, page_num: int, markdown: str):
+def _commit_page_result():
+    """Commit a parse worker's page write without waiting for the WAL flush.
+
+    A crash can lose only the last few such commits, which leaves those pages
+    pending and resume re-parses them; nothing is left half-written.
+    """
+    db.session.execute(text("SET LOCAL synchronous_commit TO OFF"))
+    db.session.commit()
+
+
+def db_update_page_done(uid: str, page_num: int, markdown: str, tables: list[dict] | None = None):
     p = db.session.get(Page, (uid, page_num))
     if p:
         p.markdown = markdown
+        p.tables = tables
         p.state = "done"
-        db.session.commit()
+        _commit_page_result()
 
 
 def db_update_page_error(uid: str, page_num: int, error: str):
@@ -172,7 +275,7 @@ def db_update_page_error(uid: str, page_num: int, error: str):
     if p:
         p.state = "error"
         p.error = error
-        db.session.commit()
+        _commit_page_result()
 
 
 def db_get_pending_page_nums(uid: str) -> list[int]:
@@ -198,13 +301,41 @@ def db_reset_error_pages(uid: str):
 def db_reset_all_pages(uid: str):
     """Reset all pages to pending state and clear markdown."""
     Page.query.filter_by(upload_id=uid).update(
-        {"state": "pending", "markdown": None, "error": None}
+        {"state": "pending", "markdown": None, "tables": None, "error": None}
     )
     db.session.commit()
 
 
 # ---------- Schema helpers ----------
 
+# Short-lived cache for schema lookups, keyed by ("id", sid) or
+# ("default", company): extract, CSV download and auto-extract hit the same
+# schema seconds apart. Any schema write through this module clears it; the
+# TTL bounds staleness across processes.
+SCHEMA_CACHE_TTL = 30.0
+_schema_cache: dict[tuple[str, str], tuple[float, dict | None]] = {}
+_schema_cache_lock = threading.Lock()
+_MISS = object()
+
+
+def _schema_cache_get(key: tuple[str, str]):
+    with _schema_cache_lock:
+        hit = _schema_cache.get(key)
+    if hit and hit[0] > time.monotonic():
+        return hit[1]
+    return _MISS
+
+
+def _schema_cache_put(key: tuple[str, str], value: dict | None):
+    with _schema_cache_lock:
+        _schema_cache[key] = (time.monotonic() + SCHEMA_CACHE_TTL, value)
+
+
+def _invalidate_schema_cache():
+    with _schema_cache_lock:
+        _schema_cache.clear()
+
+
 def _schema_to_dict(s: SchemaModel) -> dict:
     return {
         "id": s.id,
@@ -235,8 +366,16 @@ def db_create_schema(
 
 
 def db_get_schema(sid: str) -> dict | None:
+    cached = _schema_cache_get(("id", sid))
+    if cached is not _MISS:
+        return cached
+
     s = db.session.get(SchemaModel, sid)
-    return _schema_to_dict(s) if s else None
+    if not s:
+        return None
+    d = _schema_to_dict(s)
+    _schema_cache_put(("id", sid), d)
+    return d
 
 
 def db_list_schemas(
@@ -258,6 +397,7 @@ def db_update_schema(sid: str, **kw) -> dict | None:
     for k, v in kw.items():
         setattr(s, k, v)
     db.session.commit()
+    _invalidate_schema_cache()
     return _schema_to_dict(s)
 
 
@@ -266,6 +406,7 @@ def db_delete_schema(sid: str):
     if s:
         db.session.delete(s)
         db.session.commit()
+    _invalidate_schema_cache()
 
 
 def db_set_default_schema(sid: str):
@@ -276,8 +417,16 @@ def db_set_default_schema(sid: str):
     SchemaModel.query.filter_by(company=s.company).update({"is_default": False})
     s.is_default = True
     db.session.commit()
+    _invalidate_schema_cache()
 
 
 def db_get_default_schema(company: str) -> dict | None:
+    # "No default" is cached too: auto-extract asks once per upload
+    cached = _schema_cache_get(("default", company))
+    if cached is not _MISS:
+        return cached
+
     s = SchemaModel.query.filter_by(company=company, is_default=True).first()
-    return _schema_to_dict(s) if s else None
+    d = _schema_to_dict(s) if s else None
+    _schema_cache_put(("default", company), d)
+    return d
@@ -96,6 +96,10 @@ class Page(db.Model):
     markdown = db.Column(db.Text, default="")
     state = db.Column(db.String(20), nullable=False, default="pending")
     error = db.Column(db.Text)
+    # Tables extracted from markdown at parse time; NULL when not yet computed
+    # or invalidated by an edit. Deferred so bulk page reads skip it.
+    tables = db.deferred(db.Column(db.JSON))
+    updated_at = db.Column(db.DateTime, default=_utcnow, onupdate=_utcnow)
 
     upload = db.relationship("Upload", back_populates="pages")
 
@@ -1,12 +1,15 @@
 from __future__ import annotations
 
-import csv
 import math
-import re
-from collections import Counter
-from io import StringIO
+import tempfile
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
 
-from flask import Blueprint, Response, g, jsonify, request
+from flask import Blueprint, Response, current_app, g, jsonify, request
 
 from auth import workspace_required
 from db import (
@@ -18,11 +21,15 @@ from db import (
     db_get_schema,
     db_list_schemas,
     db_list_uploads_by_company_state,
+    db_parsed_pages_version,
     db_set_default_schema,
     db_update,
     db_update_schema,
 )
 import storage
+from utils.csvio import iter_csv
+from utils.headings import find_headings
+from utils.responses import json_response
 from utils.tables import extract_tables
 
 bp = Blueprint("extract", __name__)
@@ -102,26 +109,86 @@ def set_default(sid: str):
     # Only re-extract uploads in the current workspace
     for u in uploads:
         if u.get("workspace_id") == g.workspace.id:
-            run_auto_extract(u["id"])
+            run_auto_extract(u)
 
     return jsonify({"ok": True})
 
 
 # ---------- Helpers ----------
 
-def _load_pages(uid: str) -> list[dict]:
-    """Load and pre-parse all done pages for an upload."""
-    rows = db_get_parsed_pages(uid)
+class ParsedPage(NamedTuple):
+    page_num: int
+    heading_text: str
+    tables: list[dict]
 
+
+# Parsed pages per upload, keyed by uid and tagged with the pages version they
+# were built from. scan -> extract -> csv reuse a single parse.
+_PAGE_CACHE_SIZE = 64
+_page_cache: OrderedDict[str, tuple[tuple, list[ParsedPage]]] = OrderedDict()
+_page_cache_lock = threading.Lock()
+_page_parse_locks: dict[str, threading.Lock] = {}
+
+
+def _cached_pages(uid: str, version: tuple) -> list[ParsedPage] | None:
+    with _page_cache_lock:
+        hit = _page_cache.get(uid)
+        if hit and hit[0] == version:
+            _page_cache.move_to_end(uid)
+            return hit[1]
+    return None
+
+
+def _parse_pages(rows: list[dict]) -> list[ParsedPage]:
     parsed = []
     for r in rows:
         md = r["markdown"] or ""
-        headings = re.findall(r"^#+\s+(.+)", md, re.MULTILINE)
-        parsed.append({
-            "page_num": r["page_num"],
-            "heading_text": " > ".join(headings) if headings else "-",
-            "tables": extract_tables(md),
-        })
+        headings = find_headings(md)
+        # Tables stored at parse time match the current markdown (edits clear
+        # them); only pages without a stored copy are parsed here.
+        tables = r["tables"]
+        if tables is None:
+            tables = extract_tables(md)
+        # Lowercased once here, since parsed pages are cached and anchor
+        # matching compares against lowercase names on every request.
+        tables = [
+            {**t, "display_lower": [c.lower() for c in t.get("display_columns", [])]}
+            for t in tables
+        ]
+        parsed.append(ParsedPage(
+            page_num=r["page_num"],
+            heading_text=" > ".join(headings) if headings else "-",
+            tables=tables,
+        ))
+    return parsed
+
+
+def _load_pages(uid: str) -> list[ParsedPage]:
+    """Load and pre-parse all done pages for an upload.
+
+    Results are cached until the upload's done pages change and are shared
+    between requests, so callers must not mutate them.
+    """
+    version = db_parsed_pages_version(uid)
+    parsed = _cached_pages(uid, version)
+    if parsed is not None:
+        return parsed
+
+    with _page_cache_lock:
+        parse_lock = _page_parse_locks.setdefault(uid, threading.Lock())
+    with parse_lock:
+        # Another thread may have parsed this version while we waited
+        parsed = _cached_pages(uid, version)
+        if parsed is not None:
+            return parsed
+
+        parsed = _parse_pages(db_get_parsed_pages(uid))
+        with _page_cache_lock:
+            _page_cache[uid] = (version, parsed)
+            _page_cache.move_to_end(uid)
+            while len(_page_cache) > _PAGE_CACHE_SIZE:
+                evicted, _ = _page_cache.popitem(last=False)
+                _page_parse_locks.pop(evicted, None)
     return parsed
 
 
@@ -133,63 +200,76 @@ def _derive_variant(display_col: str, anchor: str) -> str:
 
 
 def _find_nearest_left(val_idx: int, ref_indices: list[int]) -> int | None:
-    best = None
-    for ri in ref_indices:
-        if ri <= val_idx:
-            if best is None or ri > best:
-                best = ri
-    return best if best is not None else (ref_indices[0] if ref_indices else None)
+    """Nearest reference column at or left of val_idx (ref_indices is sorted)."""
+    if not ref_indices:
+        return None
+    i = bisect_right(ref_indices, val_idx) - 1
+    return ref_indices[i] if i >= 0 else ref_indices[0]
+
+
+def _has_distinct_values(row: list[str]) -> bool:
+    """True if the row has at least two different non-empty, non-dash values."""
+    first = None
+    for v in row:
+        if not v or v == "-":
+            continue
+        if first is None:
+            first = v
+        elif v != first:
+            return True
+    return False
 
 
 # ---------- Scan ----------
 
 def _scan_tables(uid: str, row_anchor: str, value_anchor: str) -> dict:
-    parsed_pages = _load_pages(uid)
-
     ra = row_anchor.lower()
     va = value_anchor.lower()
 
+    parsed_pages = _load_pages(uid)
+
     tables_found = 0
     pages_found: set[int] = set()
-    row_cols_seen: set[str] = set()
-    value_cols_seen: set[str] = set()
-    extra_cols_seen: set[str] = set()
-    row_columns: list[str] = []
-    value_columns: list[str] = []
-    extra_columns: list[str] = []
+    # Insertion-ordered dicts double as "seen" sets and first-seen ordering
+    row_columns: dict[str, None] = {}
+    value_columns: dict[str, None] = {}
+    extra_columns: dict[str, None] = {}
 
     for pp in parsed_pages:
-        for t in pp["tables"]:
+        for t in pp.tables:
             dc = t.get("display_columns", [])
-            has_ref = any(ra in c.lower() for c in dc)
-            has_val = any(va in c.lower() for c in dc)
-            if not (has_ref and has_val):
+            dc_lower = t["display_lower"]
+
+            # Classify every column in a single walk
+            row_hits: list[str] = []
+            value_hits: list[str] = []
+            extra_hits: list[str] = []
+            has_val = False
+            for c, cl in zip(dc, dc_lower):
+                is_val = va in cl
+                has_val = has_val or is_val
+                if ra in cl:
+                    row_hits.append(c)
+                elif is_val:
+                    value_hits.append(c)
+                else:
+                    extra_hits.append(c)
+            if not (row_hits and has_val):
                 continue
 
             tables_found += 1
-            pages_found.add(pp["page_num"])
+            pages_found.add(pp.page_num)
 
-            for c in dc:
-                cl = c.lower()
-                if ra in cl:
-                    if c not in row_cols_seen:
-                        row_cols_seen.add(c)
-                        row_columns.append(c)
-                elif va in cl:
-                    if c not in value_cols_seen:
-                        value_cols_seen.add(c)
-                        value_columns.append(c)
-                else:
-                    if c not in extra_cols_seen:
-                        extra_cols_seen.add(c)
-                        extra_columns.append(c)
+            row_columns.update(dict.fromkeys(row_hits))
+            value_columns.update(dict.fromkeys(value_hits))
+            extra_columns.update(dict.fromkeys(extra_hits))
 
     return {
         "tables_found": tables_found,
         "pages_found": len(pages_found),
-        "row_columns": row_columns,
-        "value_columns": value_columns,
-        "extra_columns": extra_columns,
+        "row_columns": list(row_columns),
+        "value_columns": list(value_columns),
+        "extra_columns": list(extra_columns),
     }
 
 
@@ -207,7 +287,7 @@ def scan_columns(uid: str):
         return jsonify({"error": "Both row_anchor and value_anchor required"}), 400
 
     result = _scan_tables(uid, row_anchor, value_anchor)
-    return jsonify(result)
+    return json_response(result)
 
 
 # ---------- Extraction ----------
@@ -266,9 +346,14 @@ def _apply_fill_down(tables: list[dict], val_indices: list[int]) -> None:
                         row[vi] = first_value
 
 
-def _extract(uid: str, config: dict) -> dict:
-    parsed_pages = _load_pages(uid)
+def _iter_extract(
+    uid: str, config: dict
+) -> tuple[list[str], Iterator[tuple[list[str], int, int]]]:
+    """Plan an extraction and return (columns, rows).
 
+    rows lazily yields (row, table_index, page_num) so callers can stream
+    large extractions without holding every row in memory.
+    """
     row_anchor = config.get("row_anchor", "").strip()
     value_anchor = config.get("value_anchor", "").strip()
     extras_list: list[str] = config.get("extras", [])
@@ -278,105 +363,128 @@ def _extract(uid: str, config: dict) -> dict:
 
     ra = row_anchor.lower()
     va = value_anchor.lower()
+    extras_lower = [e.lower() for e in extras_list]
 
-    all_value_display: set[str] = set()
-    for pp in parsed_pages:
-        for t in pp["tables"]:
-            for c in t.get("display_columns", []):
-                if va in c.lower():
-                    all_value_display.add(c)
-    has_variants = len(all_value_display) > 1
+    parsed_pages = _load_pages(uid)
 
-    output_columns: list[str] = []
+    # The header must be known before the first row is streamed, so whether a
+    # Variant column exists is settled here rather than by patching rows after
+    # the loop. This only reads table headers of the already-parsed pages,
+    # never their rows.
+    value_displays = {
+        c
+        for pp in parsed_pages
+        for t in pp.tables
+        for c, cl in zip(t.get("display_columns", []), t["display_lower"])
+        if va in cl
+    }
+    variants: dict[str, str] | None = None
+    if len(value_displays) > 1:
+        variants = {c: _derive_variant(c, value_anchor) or "-" for c in value_displays}
+
+    columns: list[str] = []
     if include_page:
-        output_columns.append("Page")
-    output_columns.extend(extras_list)
-    output_columns.append(row_anchor)
-    if has_variants:
-        output_columns.append("Variant")
-    output_columns.append(value_anchor)
+        columns.append("Page")
+    columns.extend(extras_list)
+    columns.append(row_anchor)
+    if variants is not None:
+        columns.append("Variant")
+    columns.append(value_anchor)
     if include_heading:
-        output_columns.append("Heading")
+        columns.append("Heading")
+
+    def rows() -> Iterator[tuple[list[str], int, int]]:
+        for pp in parsed_pages:
+            page_num = pp.page_num
+            heading_text = pp.heading_text
+
+            for ti, t in enumerate(pp.tables):
+                dc = t.get("display_columns", [])
+                dc_lower = t["display_lower"]
+                rows = t.get("rows", [])
+                if not rows:
+                    continue
 
-    output_rows: list[list[str]] = []
-    row_table_indices: list[int] = []
-    pages_used: set[int] = set()
+                # Most tables carry neither anchor; bail out on a short-circuiting
+                # check before building any index lists.
+                if not any(ra in cl for cl in dc_lower) or not any(va in cl for cl in dc_lower):
+                    continue
+                ref_indices = [i for i, cl in enumerate(dc_lower) if ra in cl]
+                val_indices = [i for i, cl in enumerate(dc_lower) if va in cl]
+
+                # Apply fill-down for value column if enabled (rowspan recovery).
+                # Work on a copy: parsed pages are cached and shared.
+                if fill_down_value:
+                    rows = [list(r) for r in rows]
+                    _apply_fill_down([{"rows": rows}], val_indices)
+
+                dc_index: dict[str, int] = {}
+                for i, cl in enumerate(dc_lower):
+                    dc_index.setdefault(cl, i)
+                extra_indices = [dc_index.get(e) for e in extras_lower]
+
+                # The reference column for each value column depends only on the
+                # table header, so resolve it once rather than per row.
+                value_refs = [(vi, _find_nearest_left(vi, ref_indices)) for vi in val_indices]
+
+                for data_row in rows:
+                    # Skip section-header rows (all filled cells hold the same value)
+                    if not _has_distinct_values(data_row):
+                        continue
 
-    for pp in parsed_pages:
-        page_num = pp["page_num"]
-        heading_text = pp["heading_text"]
+                    for vi, ri in value_refs:
+                        if vi >= len(data_row) or ri is None:
+                            continue
+                        value = data_row[vi]
+                        if not value or value == "-":
+                            continue
 
-        for ti, t in enumerate(pp["tables"]):
-            dc = t.get("display_columns", [])
-            rows = t.get("rows", [])
-            if not rows:
-                continue
+                        reference = data_row[ri] if ri < len(data_row) else ""
 
-            ref_indices = [i for i, c in enumerate(dc) if ra in c.lower()]
-            val_indices = [i for i, c in enumerate(dc) if va in c.lower()]
-            if not ref_indices or not val_indices:
-                continue
+                        # Skip rows where row anchor is empty (header/label rows)
+                        if not reference or reference == "-":
+                            continue
 
-            # Apply fill-down for value column if enabled (rowspan recovery)
-            if fill_down_value:
-                _apply_fill_down([t], val_indices)
-
-            extra_indices: list[int | None] = []
-            for ext in extras_list:
-                ext_lower = ext.lower()
-                found = None
-                for i, c in enumerate(dc):
-                    if c.lower() == ext_lower:
-                        found = i
-                        break
-                extra_indices.append(found)
+                        out: list[str] = []
+                        if include_page:
+                            out.append(str(page_num))
+                        for ei in extra_indices:
+                            out.append(data_row[ei] if ei is not None and ei < len(data_row) else "-")
+                        out.append(reference)
+                        if variants is not None:
+                            out.append(variants[dc[vi]])
+                        out.append(value)
+                        if include_heading:
+                            out.append(heading_text)
 
-            for data_row in rows:
-                unique_vals = set(v for v in data_row if v and v != "-")
-                if len(unique_vals) <= 1:
-                    continue
+                        yield out, ti, page_num
 
-                for vi in val_indices:
-                    if vi >= len(data_row):
-                        continue
-                    value = data_row[vi]
-                    if not value or value == "-":
-                        continue
+    return columns, rows()
 
-                    ri = _find_nearest_left(vi, ref_indices)
-                    if ri is None:
-                        continue
-                    reference = data_row[ri] if ri < len(data_row) else ""
 
-                    # Skip rows where row anchor is empty (header/label rows)
-                    if not reference or reference == "-":
-                        continue
+def _extract(uid: str, config: dict) -> dict:
+    columns, rows = _iter_extract(uid, config)
 
-                    out: list[str] = []
-                    if include_page:
-                        out.append(str(page_num))
-                    for ei in extra_indices:
-                        out.append(data_row[ei] if ei is not None and ei < len(data_row) else "-")
-                    out.append(reference)
-                    if has_variants:
-                        variant = _derive_variant(dc[vi], value_anchor)
-                        out.append(variant if variant else "-")
-                    out.append(value)
-                    if include_heading:
-                        out.append(heading_text)
-
-                    output_rows.append(out)
-                    row_table_indices.append(ti)
-                    pages_used.add(page_num)
-
-    flags = _detect_anomalies(output_columns, output_rows)
+    output_rows: list[list[str]] = []
+    row_table_indices: list[int] = []
+    # Rows arrive in page order, so distinct pages can be counted on change
+    page_count = 0
+    last_page = None
+    for out, ti, page_num in rows:
+        output_rows.append(out)
+        row_table_indices.append(ti)
+        if page_num != last_page:
+            page_count += 1
+            last_page = page_num
+
+    flags = _detect_anomalies(columns, output_rows)
 
     return {
-        "columns": output_columns,
+        "columns": columns,
         "rows": output_rows,
         "flags": flags,
         "flagged_count": len({f["row"] for f in flags}),
-        "page_count": len(pages_used),
+        "page_count": page_count,
         "row_count": len(output_rows),
         "row_table_indices": row_table_indices,
     }
@@ -395,6 +503,28 @@ def _is_numeric(v: str) -> bool:
         return False
 
 
+class _DigitDeleteMap(dict):
+    """str.translate table deleting every character for which str.isdigit()
+    is true (including superscripts like the ² in mm² and non-ASCII
+    numerals). Filled lazily per code point."""
+
+    def __missing__(self, cp: int) -> int | None:
+        v = None if chr(cp).isdigit() else cp
+        self[cp] = v
+        return v
+
+
+_DIGITS_TABLE = _DigitDeleteMap()
+
+
+def _digit_count(v: str) -> int:
+    """Count digits in a value, as sum(c.isdigit() for c in v) would.
+
+    translate runs in C, unlike a per-char loop.
+    """
+    return len(v) - len(v.translate(_DIGITS_TABLE))
+
+
 def _strip_markers(v: str) -> str:
     """Strip trailing stock/status markers from values for length comparison."""
     # Common markers: ■ (stock item), ✓ (check mark), * (footnote), etc.
@@ -419,11 +549,15 @@ def _profile_column(values: list[str]) -> dict:
     # Strip trailing markers for length calculation
     lengths = sorted(len(_strip_markers(v)) for v in values)
     digit_ratios = sorted(
-        sum(c.isdigit() for c in v) / max(len(v), 1) for v in values
+        _digit_count(v) / max(len(v), 1) for v in values
     )
     numeric_count = sum(1 for v in values if _is_numeric(v))
-    freq = Counter(v.lower().rstrip("*") for v in values)
     common_threshold = max(3, len(values) * 0.005)
+    tally: dict[str, int] = {}
+    for v in values:
+        key = v.lower().rstrip("*")
+        tally[key] = tally.get(key, 0) + 1
+    common_values = {k for k, n in tally.items() if n >= common_threshold}
 
     q1_len = _percentile(lengths, 25)
     q3_len = _percentile(lengths, 75)
@@ -442,8 +576,7 @@ def _profile_column(values: list[str]) -> dict:
         "q1_len": q1_len,
         "q3_len": q3_len,
         "digit_ratio_median": median_dr,
-        "freq": freq,
-        "common_threshold": common_threshold,
+        "common_values": common_values,
     }
 
 
@@ -451,11 +584,7 @@ def _check_cell(value: str, profile: dict) -> str | None:
     if profile.get("skip") or not value or value == "-":
         return None
 
-    freq = profile["freq"]
-    threshold = profile.get("common_threshold", 5)
-    is_common = freq.get(value.lower().rstrip("*"), 0) >= threshold
-
-    if is_common:
+    if value.lower().rstrip("*") in profile["common_values"]:
         return None
 
     if profile["is_numeric_col"] and not _is_numeric(value):
@@ -470,36 +599,42 @@ def _check_cell(value: str, profile: dict) -> str | None:
     if vlen > upper:
         return f"unusual length ({vlen} chars, expected {int(lower)}-{int(upper)})"
 
-    dr = sum(c.isdigit() for c in value) / max(len(value), 1)
+    dr = _digit_count(value) / max(len(value), 1)
     if abs(dr - profile["digit_ratio_median"]) > 0.7:
         return "unusual character pattern"
 
     return None
 
 
-def _detect_anomalies(columns: list[str], rows: list[list[str]]) -> list[dict]:
-    if not rows or not columns:
+def _flag_column(ci: int, rows: list[list[str]]) -> list[dict]:
+    """Profile one output column and flag the cells that don't fit its profile."""
+    col_values = [r[ci] for r in rows if ci < len(r) and r[ci] and r[ci] != "-"]
+    profile = _profile_column(col_values)
+    if profile["skip"]:
         return []
 
-    n_cols = len(columns)
-
-    skip_cols = {"page", "heading", "variant"}
-    profiles = []
-    for ci in range(n_cols):
-        col_lower = columns[ci].lower()
-        if col_lower in skip_cols:
-            profiles.append({"skip": True})
-        else:
-            col_values = [r[ci] for r in rows if ci < len(r) and r[ci] and r[ci] != "-"]
-            profiles.append(_profile_column(col_values))
-
     flags = []
     for ri, row in enumerate(rows):
-        for ci in range(min(len(row), n_cols)):
-            reason = _check_cell(row[ci], profiles[ci])
+        if ci < len(row):
+            reason = _check_cell(row[ci], profile)
             if reason:
                 flags.append({"row": ri, "col": ci, "reason": reason})
+    return flags
+
+
+def _detect_anomalies(columns: list[str], rows: list[list[str]]) -> list[dict]:
+    if not rows or not columns:
+        return []
+
+    # Columns are profiled and scanned independently of each other; the
+    # work is pure Python, so it stays on this thread rather than a pool.
+    skip_cols = {"page", "heading", "variant"}
+    flags = []
+    for ci, col in enumerate(columns):
+        if col.lower() not in skip_cols:
+            flags.extend(_flag_column(ci, rows))
 
+    flags.sort(key=lambda f: (f["row"], f["col"]))
     return flags
 
 
@@ -523,7 +658,17 @@ def extract_data(uid: str):
     db_update(uid, extract_state="done",
               message=f"Done — {total_pages} pages, {row_count} rows extracted")
 
-    return jsonify(result)
+    # ?format=soa returns column-major data (one list per output column)
+    # instead of a list of rows; much smaller to encode for large results.
+    if request.args.get("format") == "soa":
+        rows = result.pop("rows")
+        n_cols = len(result["columns"])
+        result["data"] = [list(col) for col in zip(*rows)] if rows else [[] for _ in range(n_cols)]
+
+    return json_response(result)
+
+
+CSV_SPOOL_MAX_BYTES = 8 * 1024 * 1024
 
 
 @bp.route("/api/uploads/<uid>/extract/csv", methods=["POST"])
@@ -538,16 +683,11 @@ def extract_csv(uid: str):
     if config is None:
         return jsonify({"error": "Provide valid config or schema_id"}), 400
 
-    result = _extract(uid, config)
-
-    buf = StringIO()
-    writer = csv.writer(buf)
-    writer.writerow(result["columns"])
-    writer.writerows(result["rows"])
+    columns, rows = _iter_extract(uid, config)
 
     basename = u["filename"].rsplit(".", 1)[0] if u.get("filename") else uid
     return Response(
-        buf.getvalue(),
+        iter_csv(columns, (out for out, _, _ in rows)),
         mimetype="text/csv",
         headers={
             "Content-Disposition": f'attachment; filename="{basename}_extract.csv"'
@@ -557,11 +697,53 @@ def extract_csv(uid: str):
 
 # ---------- Auto-extraction ----------
 
-def run_auto_extract(uid: str):
-    """Auto-extract after parsing completes, using the company's default config."""
-    u = db_get(uid)
+# Auto-extractions triggered from request handlers run here instead of on the
+# request thread. Runs for one upload are serialized, and requests arriving
+# while a run is still queued coalesce into it. A per-upload lock is dropped
+# once its last run finishes, so the dict only holds uploads with work.
+_auto_extract_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="auto-extract")
+_auto_extract_queued: set[str] = set()
+_auto_extract_locks: dict[str, threading.Lock] = {}
+_auto_extract_lock = threading.Lock()
+
+
+def schedule_auto_extract(uid: str) -> None:
+    """Queue run_auto_extract(uid) on the background pool."""
+    app = current_app._get_current_object()
+    with _auto_extract_lock:
+        if uid in _auto_extract_queued:
+            return
+        _auto_extract_queued.add(uid)
+        run_lock = _auto_extract_locks.setdefault(uid, threading.Lock())
+
+    def _run():
+        with run_lock:
+            # From here on a new request must queue a fresh run, since this
+            # one may already have read the pages.
+            with _auto_extract_lock:
+                _auto_extract_queued.discard(uid)
+            try:
+                with app.app_context():
+                    run_auto_extract(uid)
+            finally:
+                with _auto_extract_lock:
+                    # A run queued meanwhile is waiting on this lock; keep it
+                    if uid not in _auto_extract_queued:
+                        _auto_extract_locks.pop(uid, None)
+
+    _auto_extract_pool.submit(_run)
+
+
+def run_auto_extract(upload: str | dict):
+    """Auto-extract after parsing completes, using the company's default config.
+
+    Accepts an upload id, or an upload dict already fetched by the caller to
+    skip the extra lookup.
+    """
+    u = db_get(upload) if isinstance(upload, str) else upload
     if not u:
         return
+    uid = u["id"]
 
     total_pages = u.get("total_pages", 0)
     company = u.get("company", "")
@@ -580,16 +762,27 @@ def run_auto_extract(uid: str):
     try:
         db_update(uid, extract_state="running",
                   message=f"Extracting data...")
-        result = _extract(uid, cfg)
+        columns, rows = _iter_extract(uid, cfg)
+
+        row_count = 0
+
+        def counted_rows():
+            nonlocal row_count
+            for out, _, _ in rows:
+                row_count += 1
+                yield out
 
+        # Stream into a spooled temp file (spills to disk for large
+        # extractions) and upload from there; Minio only publishes the
+        # object once the upload completes.
         csv_filename = f"{uid}_extract.csv"
-        buf = StringIO()
-        writer = csv.writer(buf)
-        writer.writerow(result["columns"])
-        writer.writerows(result["rows"])
-        storage.upload_csv(csv_filename, buf.getvalue().encode("utf-8"))
+        with tempfile.SpooledTemporaryFile(max_size=CSV_SPOOL_MAX_BYTES) as tmp:
+            for chunk in iter_csv(columns, counted_rows()):
+                tmp.write(chunk.encode("utf-8"))
+            size = tmp.tell()
+            tmp.seek(0)
+            storage.upload_csv_file(csv_filename, tmp, size)
 
-        row_count = result.get("row_count", len(result["rows"]))
         db_update(uid, extract_state="done", extract_csv=csv_filename,
                   message=f"Done — {total_pages} pages, {row_count} rows extracted")
     except Exception:
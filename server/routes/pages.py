@@ -1,25 +1,95 @@
 from __future__ import annotations
 
+import atexit
 import base64
-import csv
 import logging
 import re
-from io import BytesIO, StringIO
+import threading
+import zlib
+from bisect import bisect_left
+from collections import OrderedDict
+from collections.abc import Callable, Iterator
+from concurrent.futures import Future
+from datetime import datetime, timezone
+from functools import lru_cache
+from html.parser import HTMLParser
+from io import BytesIO
+from typing import TypeVar
 
 import httpx
-from flask import Blueprint, Response, g, jsonify, request
+from flask import Blueprint, Response, g, jsonify, request, stream_with_context
 from PIL import Image
 
-from auth import workspace_required
+from auth import upload_required, workspace_required
 from config import LLM_MODEL, LLM_SERVER_URL, VLM_MODEL, VLM_SERVER_URL
-from db import db_get, db_get_page, db_get_parsed_pages, db_page_states, db_update_page
+from db import (
+    db_get,
+    db_get_page,
+    db_iter_parsed_pages,
+    db_page_states,
+    db_parsed_pages_version,
+    db_update_page,
+)
 import storage
+from utils.csvio import iter_csv
+from utils.headings import RE_HEADING, find_headings
+from utils.responses import json_response
 from utils.tables import extract_tables
 
 log = logging.getLogger(__name__)
 
 bp = Blueprint("pages", __name__)
 
+PAGE_IMAGE_MAX_AGE = 86400  # browser cache lifetime for page images
+
+_T = TypeVar("_T")
+
+_RE_PAGE_FILE = re.compile(r"page_(\d+)\.png")
+_RE_TABLE_BLOCK = re.compile(r"<table[\s\S]*?</table>", re.IGNORECASE)
+_RE_TR = re.compile(r"<tr", re.IGNORECASE)
+_RE_NONBLANK_LINE = re.compile(r"^[^\S\n]*\S", re.MULTILINE)
+
+# Data derived from a page's markdown (parsed tables, table blocks, regions)
+# per (uid, page_num). Each slot remembers the markdown it was built from and
+# starts over as soon as that changes, so an edited page is never served stale.
+_PAGE_CACHE_SIZE = 128
+_page_cache: OrderedDict[tuple[str, int], dict] = OrderedDict()
+_page_cache_lock = threading.Lock()
+
+
+def _page_derived(uid: str, page_num: int, md: str, name: str, build: Callable[[str], _T]) -> _T:
+    """Return build(md), reusing the value cached under name for this page."""
+    key = (uid, page_num)
+    with _page_cache_lock:
+        slot = _page_cache.get(key)
+        if slot is None or slot["markdown"] != md:
+            slot = _page_cache[key] = {"markdown": md}
+        _page_cache.move_to_end(key)
+        while len(_page_cache) > _PAGE_CACHE_SIZE:
+            _page_cache.popitem(last=False)
+        if name in slot:
+            return slot[name]
+
+    value = build(md)
+    with _page_cache_lock:
+        slot[name] = value
+    return value
+
+
+def _page_tables_cached(uid: str, page_num: int, md: str) -> list[dict]:
+    return _page_derived(uid, page_num, md, "tables", extract_tables)
+
+
+def _page_tables(p: dict) -> list[dict]:
+    """Tables for a page loaded with_tables, preferring the copy stored at parse time."""
+    if p.get("tables") is not None:
+        return p["tables"]
+    return _page_tables_cached(p["upload_id"], p["page_num"], p.get("markdown") or "")
+
+
+def _page_headings_cached(uid: str, page_num: int, md: str) -> list[str]:
+    return _page_derived(uid, page_num, md, "headings", find_headings)
+
 
 @bp.route("/pages/<uid>/<filename>")
 def serve_page(uid: str, filename: str):
@@ -29,91 +99,149 @@ def serve_page(uid: str, filename: str):
     if not u:
         return jsonify({"error": "Not found"}), 404
 
-    match = re.match(r"page_(\d+)\.png", filename)
+    match = _RE_PAGE_FILE.match(filename)
     if not match:
         return jsonify({"error": "Invalid filename"}), 400
 
     page_num = int(match.group(1))
     try:
-        data = storage.get_page_image(uid, page_num)
-        return Response(data, mimetype="image/png")
+        chunks, length = storage.stream_page_image(uid, page_num)
     except Exception:
         return jsonify({"error": "Page not found"}), 404
+    # Page images never change once rendered, so let the browser keep them.
+    # Private: shared caches must not outlive a deleted upload by a day
+    # (nginx keeps them only briefly, see ec2/nginx.conf).
+    resp = Response(chunks, mimetype="image/png", direct_passthrough=True)
+    if length:
+        resp.content_length = length
+    resp.cache_control.private = True
+    resp.cache_control.max_age = PAGE_IMAGE_MAX_AGE
+    return resp
 
 
 @bp.route("/api/uploads/<uid>/pages")
 @workspace_required
+@upload_required
 def list_pages(uid: str):
     """List all page image filenames for an upload."""
-    u = db_get(uid)
-    if not u or u.get("workspace_id") != g.workspace.id:
-        return jsonify({"error": "Not found"}), 404
-
     files = storage.list_page_images(uid)
-    return jsonify(files)
+    return json_response(files)
+
+
+def _conditional(etag: str | None, build: Callable[[], Response],
+                 last_modified: datetime | None = None) -> Response:
+    """Answer 304 when the client already holds etag, otherwise build().
+
+    Responses carry no-cache so browsers always revalidate instead of
+    guessing freshness from Last-Modified.
+    """
+    if etag and request.if_none_match.contains(etag):
+        resp = Response(status=304)
+    else:
+        resp = build()
+    if etag:
+        resp.set_etag(etag)
+        resp.cache_control.no_cache = True
+        if last_modified is not None:
+            resp.last_modified = last_modified
+    return resp
+
+
+def _page_conditional(p: dict, build: Callable[[], Response]) -> Response:
+    """_conditional keyed on a page row's updated_at."""
+    if not p.get("updated_at"):
+        return build()
+    updated = datetime.fromisoformat(p["updated_at"])
+    if updated.tzinfo is None:
+        updated = updated.replace(tzinfo=timezone.utc)
+    return _conditional(f"{p['page_num']}-{updated.timestamp()}", build, updated)
 
 
 @bp.route("/api/uploads/<uid>/page-states")
 @workspace_required
+@upload_required
 def page_states(uid: str):
-    u = db_get(uid)
-    if not u or u.get("workspace_id") != g.workspace.id:
-        return jsonify({"error": "Not found"}), 404
-    return jsonify(db_page_states(uid))
+    # Cheap to compute but polled constantly; a body-hash ETag saves the transfer.
+    resp = json_response(db_page_states(uid))
+    resp.add_etag()
+    resp.cache_control.no_cache = True
+    return resp.make_conditional(request)
 
 
 @bp.route("/api/uploads/<uid>/page/<int:page_num>")
 @workspace_required
+@upload_required
 def page_markdown(uid: str, page_num: int):
-    u = db_get(uid)
-    if not u or u.get("workspace_id") != g.workspace.id:
-        return jsonify({"error": "Not found"}), 404
-
     p = db_get_page(uid, page_num)
     if not p:
         return jsonify({"error": "Page not found"}), 404
-    return jsonify(p)
+    return _page_conditional(p, lambda: json_response(p))
 
 
 @bp.route("/api/uploads/<uid>/markdown")
 @workspace_required
+@upload_required
 def combined_markdown(uid: str):
-    u = db_get(uid)
-    if not u or u.get("workspace_id") != g.workspace.id:
-        return jsonify({"error": "Not found"}), 404
-
-    rows = db_get_parsed_pages(uid)
-
-    parts = []
-    for r in rows:
-        parts.append(f"<!-- Page {r['page_num']} -->\n\n{r['markdown'] or ''}")
-    combined = "\n\n---\n\n".join(parts)
-
+    u = g.upload
     basename = u["filename"].rsplit(".", 1)[0] if u.get("filename") else uid
-    return Response(
-        combined,
+    count, last_page, last_edit = db_parsed_pages_version(uid)
+    # The download name is part of the response, so a rename must change it too.
+    etag = f"{count}-{last_page}-{last_edit.timestamp()}-{zlib.crc32(basename.encode()):08x}" if last_edit else None
+    return _conditional(etag, lambda: Response(
+        stream_with_context(_iter_combined_markdown(uid)),
         mimetype="text/markdown",
         headers={"Content-Disposition": f'attachment; filename="{basename}.md"'},
-    )
+    ))
+
+
+def _count_nonblank_lines(text: str, start: int, end: int) -> int:
+    """Count the lines in text[start:end] that hold anything but whitespace.
+
+    Scans in place with pos/endpos rather than slicing the range out.
+    """
+    count = 0
+    if start and text[start - 1] != "\n":
+        # ^ only matches at real line starts, so check the partial first
+        # line (e.g. the rest of a line after </table>) by hand.
+        nl = text.find("\n", start, end)
+        first_end = end if nl == -1 else nl
+        if first_end > start and not text[start:first_end].isspace():
+            count = 1
+        start = first_end
+    return count + len(_RE_NONBLANK_LINE.findall(text, start, end))
+
+
+def _iter_combined_markdown(uid: str) -> Iterator[str]:
+    """Yield the upload's pages as one markdown document, page by page."""
+    separator = ""
+    for page_num, markdown in db_iter_parsed_pages(uid):
+        yield f"{separator}<!-- Page {page_num} -->\n\n{markdown or ''}"
+        separator = "\n\n---\n\n"
 
 
 def _estimate_table_regions(markdown: str) -> list[dict]:
     """Estimate vertical positions of tables on a page from markdown structure."""
-    parts = re.split(r"(<table.*?</table>)", markdown, flags=re.DOTALL | re.IGNORECASE)
-
     segments: list[tuple] = []
     table_idx = 0
-
-    for part in parts:
-        stripped = part.strip()
-        if stripped.lower().startswith("<table"):
-            row_count = len(re.findall(r"<tr", part, re.IGNORECASE))
-            segments.append(("table", max(row_count, 1), table_idx))
-            table_idx += 1
-        else:
-            text_lines = len([l for l in part.split("\n") if l.strip()])
-            if text_lines > 0:
-                segments.append(("text", text_lines))
+    last_end = 0
+
+    for m in _RE_TABLE_BLOCK.finditer(markdown):
+        text_lines = _count_nonblank_lines(markdown, last_end, m.start())
+        if text_lines > 0:
+            segments.append(("text", text_lines))
+        row_count = len(_RE_TR.findall(markdown, m.start(), m.end()))
+        segments.append(("table", max(row_count, 1), table_idx))
+        table_idx += 1
+        last_end = m.end()
+
+    # An unterminated trailing <table> still counts as a (truncated) table.
+    tail = markdown[last_end:]
+    if tail.lstrip()[:6].lower() == "<table":
+        segments.append(("table", max(len(_RE_TR.findall(tail)), 1), table_idx))
+    else:
+        text_lines = _count_nonblank_lines(markdown, last_end, len(markdown))
+        if text_lines > 0:
+            segments.append(("text", text_lines))
 
     total_weight = sum(s[1] for s in segments)
     if total_weight == 0:
@@ -135,102 +263,125 @@ def _estimate_table_regions(markdown: str) -> list[dict]:
 
 @bp.route("/api/uploads/<uid>/page/<int:page_num>/table-regions")
 @workspace_required
+@upload_required
 def table_regions(uid: str, page_num: int):
-    u = db_get(uid)
-    if not u or u.get("workspace_id") != g.workspace.id:
-        return jsonify({"error": "Not found"}), 404
-
     p = db_get_page(uid, page_num)
     if not p:
         return jsonify([])
-    return jsonify(_estimate_table_regions(p.get("markdown") or ""))
+    return json_response(_page_derived(uid, page_num, p.get("markdown") or "", "regions", _estimate_table_regions))
 
 
 @bp.route("/api/uploads/<uid>/page/<int:page_num>/tables")
 @workspace_required
+@upload_required
 def page_tables(uid: str, page_num: int):
-    u = db_get(uid)
-    if not u or u.get("workspace_id") != g.workspace.id:
-        return jsonify({"error": "Not found"}), 404
-
-    p = db_get_page(uid, page_num)
+    p = db_get_page(uid, page_num, with_tables=True)
     if not p:
         return jsonify({"error": "Not found"}), 404
 
-    md = p.get("markdown") or ""
-    headings = re.findall(r"^#+\s+(.+)", md, re.MULTILINE)
-    tables = extract_tables(md)
+    def build() -> Response:
+        md = p.get("markdown") or ""
+        return json_response({
+            "page_num": page_num,
+            "headings": _page_headings_cached(uid, page_num, md),
+            "tables": _page_tables(p),
+        })
 
-    return jsonify({
-        "page_num": page_num,
-        "headings": headings,
-        "tables": tables,
-    })
+    return _page_conditional(p, build)
 
 
 @bp.route("/api/uploads/<uid>/page/<int:page_num>/tables/csv")
 @workspace_required
+@upload_required
 def page_table_csv(uid: str, page_num: int):
-    u = db_get(uid)
-    if not u or u.get("workspace_id") != g.workspace.id:
-        return jsonify({"error": "Not found"}), 404
-
-    p = db_get_page(uid, page_num)
+    p = db_get_page(uid, page_num, with_tables=True)
     if not p:
         return jsonify({"error": "Not found"}), 404
 
     table_idx = request.args.get("table", 0, type=int)
-    tables = extract_tables(p.get("markdown") or "")
+    tables = _page_tables(p)
 
     if table_idx < 0 or table_idx >= len(tables):
         return jsonify({"error": "Table index out of range"}), 404
 
     t = tables[table_idx]
-    buf = StringIO()
-    writer = csv.writer(buf)
-    writer.writerow(t["display_columns"])
-    writer.writerows(t["rows"])
-
-    return Response(
-        buf.getvalue(),
-        mimetype="text/csv",
-        headers={
-            "Content-Disposition": f'attachment; filename="page{page_num}_table{table_idx + 1}.csv"'
-        },
-    )
+
+    def build() -> Response:
+        return Response(
+            iter_csv(t["display_columns"], t["rows"]),
+            mimetype="text/csv",
+            headers={
+                "Content-Disposition": f'attachment; filename="page{page_num}_table{table_idx + 1}.csv"'
+            },
+        )
+
+    return _page_conditional(p, build)
 
 
 # ---------- VLM Table Validation ----------
 
+# One pooled client for VLM/LLM calls so keep-alive connections are reused
+# instead of paying a fresh TCP (and TLS) handshake per validation.
+_HTTP_TIMEOUT = 300.0
+_http = httpx.Client(
+    limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+    timeout=httpx.Timeout(_HTTP_TIMEOUT, connect=5.0),
+)
+atexit.register(_http.close)
+
 def _get_table_blocks(markdown: str) -> list[tuple[int, int, str]]:
     """Return list of (start, end, html) for each <table>...</table> in markdown."""
-    return [(m.start(), m.end(), m.group()) for m in re.finditer(
-        r"<table[\s\S]*?</table>", markdown, re.IGNORECASE
-    )]
+    return [(m.start(), m.end(), m.group()) for m in _RE_TABLE_BLOCK.finditer(markdown)]
 
 
 def _image_bytes_to_data_uri(image_bytes: bytes) -> str:
     """Convert PNG bytes to JPEG base64 data URI."""
-    img = Image.open(BytesIO(image_bytes)).convert("RGB")
     buf = BytesIO()
-    img.save(buf, format="JPEG", quality=90)
-    b64 = base64.b64encode(buf.getvalue()).decode()
+    with Image.open(BytesIO(image_bytes)) as img:
+        # Page renders are usually RGB already; skip the full-frame copy then.
+        rgb = img if img.mode == "RGB" else img.convert("RGB")
+        rgb.save(buf, format="JPEG", quality=90)
+    # Encode straight from the buffer's memory instead of a getvalue() copy.
+    with buf.getbuffer() as jpeg:
+        b64 = base64.b64encode(jpeg).decode("ascii")
     return f"data:image/jpeg;base64,{b64}"
 
 
-def _find_heading_before_table(markdown: str, table_start: int) -> str:
-    """Find the nearest markdown heading before the given position."""
-    text_before = markdown[:table_start]
-    matches = list(re.finditer(r"^#+\s+(.+)", text_before, re.MULTILINE))
-    if matches:
-        return matches[-1].group(1).strip()
-    return ""
+@lru_cache(maxsize=32)
+def _page_data_uri(uid: str, page_num: int) -> str:
+    """JPEG data URI of a page image. Renders never change for a given upload."""
+    return _image_bytes_to_data_uri(storage.get_page_image(uid, page_num))
+
+
+def _heading_index(markdown: str) -> list[tuple[int, int, str]]:
+    """(start, end, text) of every markdown heading, in document order."""
+    return [(m.start(), m.end(), m.group(1).strip()) for m in RE_HEADING.finditer(markdown)]
+
+
+def _find_heading_before_table(
+    markdown: str, table_start: int, headings: list[tuple[int, int, str]] | None = None
+) -> str:
+    """Find the nearest markdown heading before the given position.
+
+    Pass a prebuilt _heading_index(markdown), e.g. the one cached per page, to
+    avoid rescanning the page; without one only the prefix is scanned.
+    """
+    if headings is not None:
+        i = bisect_left(headings, (table_start,))
+        if not i:
+            return ""
+        _, end, text = headings[i - 1]
+        if end <= table_start:
+            return text
+        # The heading runs into the table's own line; match on the prefix
+        # only, exactly as a scan of markdown[:table_start] would.
+    matches = list(RE_HEADING.finditer(markdown, 0, table_start))
+    return matches[-1].group(1).strip() if matches else ""
 
 
 def _call_vlm(uid: str, page_num: int, heading: str) -> str:
     """Send page image to VLM and ask it to OCR a specific table from scratch."""
-    image_bytes = storage.get_page_image(uid, page_num)
-    image_uri = _image_bytes_to_data_uri(image_bytes)
+    image_uri = _page_data_uri(uid, page_num)
 
     table_hint = f'The table is under the heading/section: "{heading}"' if heading else "Extract the main table"
 
@@ -268,72 +419,117 @@ def _call_vlm(uid: str, page_num: int, heading: str) -> str:
         "stream": False,
     }
 
-    resp = httpx.post(
-        f"{VLM_SERVER_URL}/chat/completions",
-        json=payload,
-        timeout=300.0,
-    )
+    resp = _http.post(f"{VLM_SERVER_URL}/chat/completions", json=payload)
     resp.raise_for_status()
     content = resp.json()["choices"][0]["message"]["content"]
 
-    m = re.search(r"<table[\s\S]*?</table>", content, re.IGNORECASE)
+    m = _RE_TABLE_BLOCK.search(content)
     if m:
         return m.group()
     return content
 
 
-def _analyze_table(table_html: str) -> str:
-    """Analyze table structure and return a diagnosis of issues found."""
-    from html.parser import HTMLParser
-
-    class TableAnalyzer(HTMLParser):
-        def __init__(self):
-            super().__init__()
-            self.rows: list[list[dict]] = []
-            self.current_row: list[dict] | None = None
-            self.current_cell: dict | None = None
-            self.in_thead = False
-            self.in_tbody = False
-            self.thead_rows: list[list[dict]] = []
-            self.tbody_rows: list[list[dict]] = []
+# In-flight VLM calls keyed by (uid, page_num, heading). Validation runs at
+# temperature 0, so concurrent identical requests can share one round-trip.
+_vlm_inflight: dict[tuple[str, int, str], Future] = {}
+_vlm_inflight_lock = threading.Lock()
+# How long a joined request waits for the owner: the HTTP timeout plus slack
+# for fetching the page image, so a stuck owner cannot pin request threads.
+_VLM_JOIN_TIMEOUT = _HTTP_TIMEOUT + 30.0
+
+
+def _call_vlm_shared(uid: str, page_num: int, heading: str) -> str:
+    """Call the VLM, joining an identical call that is already in flight."""
+    key = (uid, page_num, heading)
+    with _vlm_inflight_lock:
+        fut = _vlm_inflight.get(key)
+        owner = fut is None
+        if owner:
+            fut = _vlm_inflight[key] = Future()
+    if not owner:
+        try:
+            return fut.result(timeout=_VLM_JOIN_TIMEOUT)
+        except TimeoutError:  # concurrent.futures.TimeoutError on 3.11+
+            if fut.done():
+                raise  # the owner's own error
+            raise TimeoutError(f"Shared VLM call did not finish within {_VLM_JOIN_TIMEOUT:.0f}s") from None
 
-        def handle_starttag(self, tag, attrs):
+    try:
+        result = _call_vlm(uid, page_num, heading)
+    except Exception as e:
+        fut.set_exception(e)
+        raise
+    except BaseException as e:
+        # KeyboardInterrupt/SystemExit or a worker timeout: still release the
+        # joined requests, with an error their handlers catch
+        fut.set_exception(RuntimeError(f"Shared VLM call was interrupted ({type(e).__name__})"))
+        raise
+    else:
+        fut.set_result(result)
+        return result
+    finally:
+        with _vlm_inflight_lock:
+            _vlm_inflight.pop(key, None)
+
+
+class _TableAnalyzer(HTMLParser):
+    """Collect thead/tbody rows with each cell's colspan, rowspan and text."""
+
+    def __init__(self):
+        super().__init__()
+        self.rows: list[list[dict]] = []
+        self.current_row: list[dict] | None = None
+        self.current_cell: dict | None = None
+        self.in_thead = False
+        self.in_tbody = False
+        self.thead_rows: list[list[dict]] = []
+        self.tbody_rows: list[list[dict]] = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "thead":
+            self.in_thead = True
+        elif tag == "tbody":
+            self.in_tbody = True
+        elif tag == "tr":
+            self.current_row = []
+        elif tag in ("td", "th"):
             a = dict(attrs)
-            if tag == "thead":
-                self.in_thead = True
-            elif tag == "tbody":
-                self.in_tbody = True
-            elif tag == "tr":
-                self.current_row = []
-            elif tag in ("td", "th"):
-                self.current_cell = {
-                    "tag": tag,
-                    "colspan": int(a.get("colspan", 1)),
-                    "rowspan": int(a.get("rowspan", 1)),
-                    "text": "",
-                }
-
-        def handle_endtag(self, tag):
-            if tag == "thead":
-                self.in_thead = False
-            elif tag == "tbody":
-                self.in_tbody = False
-            elif tag == "tr" and self.current_row is not None:
-                if self.in_thead:
-                    self.thead_rows.append(self.current_row)
-                else:
-                    self.tbody_rows.append(self.current_row)
-                self.current_row = None
-            elif tag in ("td", "th") and self.current_cell is not None:
-                if self.current_row is not None:
-                    self.current_row.append(self.current_cell)
-                self.current_cell = None
-
-        def handle_data(self, data):
-            if self.current_cell is not None:
-                self.current_cell["text"] += data.strip()
-
-    analyzer = TableAnalyzer()
+            self.current_cell = {
+                "tag": tag,
+                "colspan": int(a.get("colspan", 1)),
+                "rowspan": int(a.get("rowspan", 1)),
+                "text": "",
+            }
+
+    def handle_endtag(self, tag):
+        if tag == "thead":
+            self.in_thead = False
+        elif tag == "tbody":
+            self.in_tbody = False
+        elif tag == "tr" and self.current_row is not None:
+            if self.in_thead:
+                self.thead_rows.append(self.current_row)
+            else:
+                self.tbody_rows.append(self.current_row)
+            self.current_row = None
+        elif tag in ("td", "th") and self.current_cell is not None:
+            if self.current_row is not None:
+                self.current_row.append(self.current_cell)
+            self.current_cell = None
+
+    def handle_data(self, data):
+        if self.current_cell is not None:
+            self.current_cell["text"] += data.strip()
+
+
+@lru_cache(maxsize=256)
+def _table_structure(table_html: str) -> tuple[tuple[str, ...], tuple[str, ...]]:
+    """Walk a table's rows and return (per-row description lines, issues).
+
+    Cached on the HTML itself: the LLM pre-check and the diagnosis in
+    _call_llm (and any retry) analyze the same table.
+    """
+    analyzer = _TableAnalyzer()
     analyzer.feed(table_html)
 
     lines = []
@@ -374,6 +570,19 @@ def _analyze_table(table_html: str) -> str:
                 rs_idx += 1
         active_rowspans = new_spans
 
+    return tuple(lines), tuple(issues)
+
+
+def _table_has_issues(table_html: str) -> bool:
+    """True if any body row's column count disagrees with the header."""
+    return bool(_table_structure(table_html)[1])
+
+
+def _analyze_table(table_html: str) -> str:
+    """Analyze table structure and return a diagnosis of issues found."""
+    rows, issues = _table_structure(table_html)
+    lines = list(rows)
+
     if issues:
         lines.append(f"\nISSUES FOUND: {len(issues)}")
         for issue in issues:
@@ -422,15 +631,11 @@ def _call_llm(page_markdown: str, table_html: str, heading: str) -> str:
         "stream": False,
     }
 
-    resp = httpx.post(
-        f"{LLM_SERVER_URL}/chat/completions",
-        json=payload,
-        timeout=300.0,
-    )
+    resp = _http.post(f"{LLM_SERVER_URL}/chat/completions", json=payload)
     resp.raise_for_status()
     content = resp.json()["choices"][0]["message"]["content"]
 
-    m = re.search(r"<table[\s\S]*?</table>", content, re.IGNORECASE)
+    m = _RE_TABLE_BLOCK.search(content)
     if m:
         return m.group()
     return content
@@ -438,11 +643,8 @@ def _call_llm(page_markdown: str, table_html: str, heading: str) -> str:
 
 @bp.route("/api/uploads/<uid>/page/<int:page_num>/validate-table", methods=["POST"])
 @workspace_required
+@upload_required
 def validate_table(uid: str, page_num: int):
-    u = db_get(uid)
-    if not u or u.get("workspace_id") != g.workspace.id:
-        return jsonify({"error": "Not found"}), 404
-
     body = request.get_json(force=True) or {}
     table_index = body.get("table_index", 0)
     method = body.get("method", "vlm")
@@ -452,20 +654,34 @@ def validate_table(uid: str, page_num: int):
         return jsonify({"error": "Page not found"}), 404
 
     md = p.get("markdown") or ""
-    blocks = _get_table_blocks(md)
+    blocks = _page_derived(uid, page_num, md, "blocks", _get_table_blocks)
     if table_index < 0 or table_index >= len(blocks):
         return jsonify({"error": "Table index out of range"}), 404
 
     original_html = blocks[table_index][2]
-    heading = _find_heading_before_table(md, blocks[table_index][0])
+
+    # The LLM method only repairs structure, so a table whose rows already
+    # agree with its header has nothing for it to fix. The VLM re-reads cell
+    # values from the image and always runs.
+    if method == "llm" and not body.get("force") and not _table_has_issues(original_html):
+        return jsonify({
+            "original": original_html,
+            "corrected": original_html,
+            "skipped": True,
+        })
+
+    heading = _find_heading_before_table(
+        md, blocks[table_index][0],
+        _page_derived(uid, page_num, md, "heading_index", _heading_index),
+    )
 
     try:
         if method == "llm":
             corrected_html = _call_llm(md, original_html, heading)
         else:
-            if not storage.page_image_exists(uid, page_num):
-                return jsonify({"error": "Page image not found"}), 404
-            corrected_html = _call_vlm(uid, page_num, heading)
+            corrected_html = _call_vlm_shared(uid, page_num, heading)
+    except storage.NotFound:
+        return jsonify({"error": "Page image not found"}), 404
     except Exception as e:
         log.exception("%s call failed", method.upper())
         return jsonify({"error": f"{method.upper()} error: {e}"}), 502
@@ -478,11 +694,8 @@ def validate_table(uid: str, page_num: int):
 
 @bp.route("/api/uploads/<uid>/page/<int:page_num>/apply-correction", methods=["POST"])
 @workspace_required
+@upload_required
 def apply_correction(uid: str, page_num: int):
-    u = db_get(uid)
-    if not u or u.get("workspace_id") != g.workspace.id:
-        return jsonify({"error": "Not found"}), 404
-
     body = request.get_json(force=True) or {}
     table_index = body.get("table_index")
     corrected_table = body.get("corrected_table")
@@ -495,16 +708,19 @@ def apply_correction(uid: str, page_num: int):
         return jsonify({"error": "Page not found"}), 404
 
     md = p.get("markdown") or ""
-    blocks = _get_table_blocks(md)
+    blocks = _page_derived(uid, page_num, md, "blocks", _get_table_blocks)
     if table_index < 0 or table_index >= len(blocks):
         return jsonify({"error": "Table index out of range"}), 404
 
     start, end, _ = blocks[table_index]
-    new_md = md[:start] + corrected_table + md[end:]
+    new_md = "".join((md[:start], corrected_table, md[end:]))
 
     db_update_page(uid, page_num, markdown=new_md)
+    with _page_cache_lock:
+        _page_cache.pop((uid, page_num), None)
 
-    from routes.extract import run_auto_extract
-    run_auto_extract(uid)
+    from routes.extract import schedule_auto_extract
+    schedule_auto_extract(uid)
 
-    return jsonify({"ok": True})
+    # Extraction refresh runs in the background; progress shows on the upload.
+    return jsonify({"ok": True, "status": "scheduled", "status_url": f"/api/uploads/{uid}"}), 202
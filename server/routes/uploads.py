@@ -1,15 +1,15 @@
 from __future__ import annotations
 
-import json
+import os
 import threading
-import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 
 from flask import Blueprint, Response, current_app, g, jsonify, request
 from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity
 
-from auth import workspace_required
+from auth import user_exists, workspace_required
 import config
 from db import (
     db_create_pages,
@@ -18,19 +18,23 @@ from db import (
     db_get,
     db_list,
     db_update,
+    db_upload_version,
+    db_wait_upload_change,
 )
-from extensions import db
-from models import User
 import storage
-from tasks.parse import resume_parse_job, run_parse_job
+from tasks.parse import PAGE_PNG_COMPRESS_LEVEL, resume_parse_job, run_parse_job
+from utils.responses import json_dumps, json_response
 
 bp = Blueprint("uploads", __name__)
 
+STATUS_POLL_TIMEOUT = 5.0
+STATUS_FIELDS = ("state", "message", "current_page", "total_pages", "extract_state")
+
 
 @bp.route("/api/uploads")
 @workspace_required
 def list_uploads():
-    return jsonify(db_list(workspace_id=g.workspace.id))
+    return json_response(db_list(workspace_id=g.workspace.id))
 
 
 @bp.route("/api/uploads/<uid>")
@@ -39,7 +43,7 @@ def get_upload(uid: str):
     u = db_get(uid)
     if not u or u.get("workspace_id") != g.workspace.id:
         return jsonify({"error": "Not found"}), 404
-    return jsonify(u)
+    return json_response(u)
 
 
 @bp.route("/api/uploads/<uid>", methods=["DELETE"])
@@ -74,18 +78,26 @@ def update_upload(uid: str):
     if updates:
         db_update(uid, **updates)
 
-    return jsonify(db_get(uid))
+    return json_response(db_get(uid))
 
 
 ALLOWED_EXT = {".pdf", ".png", ".jpg", ".jpeg"}
+IMAGE_ENCODE_WORKERS = os.cpu_count() or 1
+
+
+def _store_page_image(uid: str, page_num: int, stream) -> None:
+    """Decode an uploaded image, re-encode it as PNG and store it as a page."""
+    from PIL import Image as PILImage
+
+    img = PILImage.open(stream).convert("RGB")
+    buf = BytesIO()
+    img.save(buf, format="PNG", compress_level=PAGE_PNG_COMPRESS_LEVEL)
+    storage.upload_page_image(uid, page_num, buf.getvalue())
 
 
 @bp.route("/upload", methods=["POST"])
 @workspace_required
 def upload():
-    import os
-    from PIL import Image as PILImage
-
     files = request.files.getlist("file")
     if not files or not files[0].filename:
         return jsonify({"error": "No file provided"}), 400
@@ -106,8 +118,13 @@ def upload():
     is_pdf = first_ext == ".pdf"
 
     if is_pdf:
-        pdf_data = files[0].read()
-        pdf_key = storage.upload_pdf(uid, pdf_data, files[0].filename)
+        # Werkzeug has already spooled the part to a temp file; hand Minio the
+        # stream rather than reading the whole PDF into memory.
+        stream = files[0].stream
+        stream.seek(0, os.SEEK_END)
+        length = stream.tell()
+        stream.seek(0)
+        pdf_key = storage.upload_pdf(uid, stream, length, files[0].filename)
         filename = files[0].filename
         total_pages = 0
     else:
@@ -115,11 +132,17 @@ def upload():
         filename = files[0].filename if len(files) == 1 else f"{len(files)} images"
         total_pages = len(files)
 
-        for i, f in enumerate(sorted(files, key=lambda f: f.filename or ""), start=1):
-            img = PILImage.open(f.stream).convert("RGB")
-            buf = BytesIO()
-            img.save(buf, format="PNG")
-            storage.upload_page_image(uid, i, buf.getvalue())
+        # Pillow releases the GIL while decoding and compressing, so pages
+        # encode in parallel instead of one after another.
+        ordered = sorted(files, key=lambda f: f.filename or "")
+        workers = min(IMAGE_ENCODE_WORKERS, len(ordered))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(
+                _store_page_image,
+                [uid] * len(ordered),
+                range(1, len(ordered) + 1),
+                [f.stream for f in ordered],
+            ))
 
     db_create_upload(
         uid=uid,
@@ -210,9 +233,7 @@ def upload_status(uid: str):
 
     try:
         verify_jwt_in_request()
-        user_id = get_jwt_identity()
-        user = db.session.get(User, user_id)
-        if not user:
+        if not user_exists(get_jwt_identity()):
             return jsonify({"error": "Unauthorized"}), 401
     except Exception:
         return jsonify({"error": "Unauthorized"}), 401
@@ -220,22 +241,23 @@ def upload_status(uid: str):
     app = current_app._get_current_object()
 
     def stream():
-        last = ""
+        last = None
+        version = db_upload_version(uid)
         while True:
             with app.app_context():
                 u = db_get(uid)
             if not u:
                 yield 'data: {"error":"not found"}\n\n'
                 break
-            d = json.dumps({
-                k: u[k] for k in ("state", "message", "current_page", "total_pages", "extract_state")
-            })
-            if d != last:
-                yield f"data: {d}\n\n"
-                last = d
+            snap = tuple(u[k] for k in STATUS_FIELDS)
+            if snap != last:
+                yield f"data: {json_dumps(dict(zip(STATUS_FIELDS, snap)))}\n\n"
+                last = snap
             if u["state"] in ("done", "error"):
                 ext = u.get("extract_state")
                 if ext != "running":
                     break
-            time.sleep(0.5)
+            # Wake on the next write to this upload; the timeout still picks
+            # up writes made outside this process.
+            version = db_wait_upload_change(uid, version, timeout=STATUS_POLL_TIMEOUT)
     return Response(stream(), mimetype="text/event-stream")
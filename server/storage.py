@@ -1,47 +1,124 @@
 from __future__ import annotations
 
+import os
+import threading
+from functools import lru_cache
 from io import BytesIO
+from typing import BinaryIO, Iterator
 
+import certifi
+import urllib3
 from minio import Minio
+from minio.deleteobjects import DeleteObject
+from minio.error import S3Error
 
 import config
 
-_client: Minio | None = None
+
+class NotFound(Exception):
+    """Raised when a requested object does not exist."""
+
+
+# Page image listings per upload. Every write and delete of page images goes
+# through this module, so entries are invalidated there rather than expiring.
+_page_list_cache: dict[str, list[str]] = {}
+_page_list_gen = 0
+_page_list_lock = threading.Lock()
+
+
+def _invalidate_page_list(uid: str) -> None:
+    global _page_list_gen
+    with _page_list_lock:
+        _page_list_cache.pop(uid, None)
+        # Bumped so a listing that raced with this write is not stored. One
+        # counter for all uploads keeps nothing behind once an upload is gone.
+        _page_list_gen += 1
+
+
+def _make_http_pool() -> urllib3.PoolManager:
+    """Connection pool for the Minio client.
+
+    minio-py's default keeps only 10 connections per host. Parse workers,
+    upload encoders and request threads all share the client, so extra
+    connections were dropped after each call and reopened on the next.
+    Same certificate and retry settings as the default.
+    """
+    return urllib3.PoolManager(
+        num_pools=4,
+        maxsize=config.MINIO_POOL_SIZE,
+        block=False,
+        timeout=urllib3.Timeout(connect=5.0, read=60.0),
+        cert_reqs="CERT_REQUIRED",
+        ca_certs=os.environ.get("SSL_CERT_FILE") or certifi.where(),
+        retries=urllib3.Retry(
+            total=5,
+            backoff_factor=0.2,
+            status_forcelist=[500, 502, 503, 504],
+        ),
+    )
+
+
+@lru_cache(maxsize=1)
+def _new_client() -> Minio:
+    return Minio(
+        config.MINIO_ENDPOINT,
+        access_key=config.MINIO_ACCESS_KEY,
+        secret_key=config.MINIO_SECRET_KEY,
+        secure=config.MINIO_SECURE,
+        http_client=_make_http_pool(),
+    )
+
+
+# Set once the buckets are known to exist. Startup tries first, but Minio may
+# not be up yet, so the first storage call after that retries until it works.
+_buckets_ready = False
+_buckets_lock = threading.Lock()
 
 
 def get_client() -> Minio:
-    """Get or create the Minio client singleton."""
-    global _client
-    if _client is None:
-        _client = Minio(
-            config.MINIO_ENDPOINT,
-            access_key=config.MINIO_ACCESS_KEY,
-            secret_key=config.MINIO_SECRET_KEY,
-            secure=config.MINIO_SECURE,
-        )
-        # Ensure buckets exist
+    """Get the Minio client singleton, making sure the buckets exist."""
+    if not _buckets_ready:
+        init_storage()
+    return _new_client()
+
+
+def init_storage():
+    """Ensure buckets exist. Raises if Minio cannot be reached."""
+    global _buckets_ready
+    with _buckets_lock:
+        if _buckets_ready:
+            return
+        client = _new_client()
         for bucket in (
             config.MINIO_BUCKET_PDFS,
             config.MINIO_BUCKET_PAGES,
             config.MINIO_BUCKET_OUTPUT,
         ):
-            if not _client.bucket_exists(bucket):
-                _client.make_bucket(bucket)
-    return _client
+            if not client.bucket_exists(bucket):
+                client.make_bucket(bucket)
+        _buckets_ready = True
 
 
 # ---------- PDF storage ----------
 
-def upload_pdf(uid: str, data: bytes, filename: str) -> str:
-    """Store a PDF. Returns the object key."""
+PDF_PART_SIZE = 8 * 1024 * 1024
+
+def upload_pdf(uid: str, fp: BinaryIO, length: int, filename: str) -> str:
+    """Store a PDF from a file object. Returns the object key.
+
+    PDFs larger than PDF_PART_SIZE go up as a multipart upload with parts
+    sent in parallel.
+    """
     key = f"{uid}.pdf"
     client = get_client()
     client.put_object(
         config.MINIO_BUCKET_PDFS,
         key,
-        BytesIO(data),
-        len(data),
+        fp,
+        length,
         content_type="application/pdf",
+        part_size=PDF_PART_SIZE,
+        num_parallel_uploads=4,
     )
     return key
 
@@ -79,61 +156,114 @@ def upload_page_image(uid: str, page_num: int, data: bytes) -> str:
         len(data),
         content_type="image/png",
     )
+    _invalidate_page_list(uid)
     return key
 
 
 def get_page_image(uid: str, page_num: int) -> bytes:
-    """Retrieve a page image."""
+    """Retrieve a page image. Raises NotFound if it does not exist."""
     key = f"{uid}/page_{page_num:03d}.png"
-    resp = get_client().get_object(config.MINIO_BUCKET_PAGES, key)
+    try:
+        resp = get_client().get_object(config.MINIO_BUCKET_PAGES, key)
+    except S3Error as e:
+        if e.code == "NoSuchKey":
+            raise NotFound(key) from e
+        raise
     data = resp.read()
     resp.close()
     resp.release_conn()
     return data
 
 
-def page_image_exists(uid: str, page_num: int) -> bool:
-    """Check if a page image exists."""
+def stream_page_image(uid: str, page_num: int, chunk_size: int = 64 * 1024) -> tuple[Iterator[bytes], int]:
+    """Open a page image for streaming. Returns (chunks, content length).
+
+    Raises NotFound before any data is read if the image does not exist.
+    """
     key = f"{uid}/page_{page_num:03d}.png"
     try:
-        get_client().stat_object(config.MINIO_BUCKET_PAGES, key)
-        return True
-    except Exception:
-        return False
+        resp = get_client().get_object(config.MINIO_BUCKET_PAGES, key)
+    except S3Error as e:
+        if e.code == "NoSuchKey":
+            raise NotFound(key) from e
+        raise
+
+    def chunks() -> Iterator[bytes]:
+        try:
+            yield from resp.stream(chunk_size)
+        finally:
+            resp.close()
+            resp.release_conn()
+
+    return chunks(), int(resp.headers.get("Content-Length", 0))
 
 
 def list_page_images(uid: str) -> list[str]:
     """List page image filenames for an upload."""
-    objects = get_client().list_objects(
-        config.MINIO_BUCKET_PAGES, prefix=f"{uid}/"
-    )
-    return sorted(
-        obj.object_name.split("/")[-1]
-        for obj in objects
-        if obj.object_name.endswith(".png")
-    )
+    with _page_list_lock:
+        names = _page_list_cache.get(uid)
+        gen = _page_list_gen
+    if names is None:
+        objects = get_client().list_objects(
+            config.MINIO_BUCKET_PAGES, prefix=f"{uid}/"
+        )
+        names = sorted(
+            obj.object_name.rpartition("/")[2]
+            for obj in objects
+            if obj.object_name.endswith(".png")
+        )
+        with _page_list_lock:
+            if _page_list_gen == gen:
+                _page_list_cache[uid] = names
+    return list(names)
 
 
 def delete_page_images(uid: str):
     """Delete all page images for an upload."""
     client = get_client()
+    # Trailing slash keeps "abc" from also matching "abcd/..."
     objects = client.list_objects(config.MINIO_BUCKET_PAGES, prefix=f"{uid}/")
-    for obj in objects:
-        client.remove_object(config.MINIO_BUCKET_PAGES, obj.object_name)
+    try:
+        # Bulk DeleteObjects (up to 1000 keys per request) instead of one
+        # request per page; errors are reported lazily, so drain them.
+        errors = list(client.remove_objects(
+            config.MINIO_BUCKET_PAGES,
+            (DeleteObject(obj.object_name) for obj in objects),
+        ))
+    finally:
+        _invalidate_page_list(uid)
+    if errors:
+        raise RuntimeError(
+            f"Failed to delete {len(errors)} page image(s) for {uid}: {errors[0].message}"
+        )
 
 
 # ---------- CSV output storage ----------
 
-def upload_csv(filename: str, data: bytes) -> str:
-    """Store an extraction CSV. Returns the object key."""
-    client = get_client()
-    client.put_object(
+# CSV objects known to exist. Only positive results are kept; uploads add
+# entries and delete_csv drops them, so a stale hit cannot outlive a delete.
+_csv_seen: set[str] = set()
+_csv_seen_lock = threading.Lock()
+
+
+def _mark_csv(filename: str, exists: bool) -> None:
+    with _csv_seen_lock:
+        if exists:
+            _csv_seen.add(filename)
+        else:
+            _csv_seen.discard(filename)
+
+
+def upload_csv_file(filename: str, fp: BinaryIO, length: int) -> str:
+    """Store an extraction CSV from a file object. Returns the object key."""
+    get_client().put_object(
         config.MINIO_BUCKET_OUTPUT,
         filename,
-        BytesIO(data),
-        len(data),
+        fp,
+        length,
         content_type="text/csv",
     )
+    _mark_csv(filename, True)
     return filename
 
 
@@ -148,15 +278,20 @@ def get_csv(filename: str) -> bytes:
 
 def csv_exists(filename: str) -> bool:
     """Check if a CSV file exists."""
+    with _csv_seen_lock:
+        if filename in _csv_seen:
+            return True
     try:
         get_client().stat_object(config.MINIO_BUCKET_OUTPUT, filename)
-        return True
     except Exception:
         return False
+    _mark_csv(filename, True)
+    return True
 
 
 def delete_csv(filename: str) -> bool:
     """Delete a CSV file. Returns True if deleted, False if not found."""
+    _mark_csv(filename, False)
     try:
         get_client().remove_object(config.MINIO_BUCKET_OUTPUT, filename)
         return True
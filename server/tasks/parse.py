@@ -1,10 +1,29 @@
 from __future__ import annotations
 
+import atexit
 import base64
+import json
+import logging
+import multiprocessing
+import os
+import re
 import tempfile
 import threading
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import time
+from collections import deque
+from collections.abc import Iterator
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
 from io import BytesIO
+from itertools import islice
 
 import httpx
 import pypdfium2 as pdfium
@@ -12,13 +31,51 @@ from flask import Flask
 from PIL import Image
 
 import storage
+from utils.responses import json_loads
+from utils.tables import extract_tables
 
 # ---------- Vision model constants ----------
 MODEL_ID = "lightonai/LightOnOCR-2-1B"
 API_KEY = "not-needed"
 PDF_SCALE = 2.77  # 200 / 72 DPI
 MAX_RESOLUTION = 1540
+PAGE_PNG_COMPRESS_LEVEL = 1  # pages are intermediates; favour encode speed over size
 PARSE_WORKERS = 8
+RENDER_WORKERS = min(8, os.cpu_count() or 1)
+RENDER_BLOCK_PAGES = 4  # pages per render task, amortizes opening the PDF
+UPLOAD_WORKERS = 16  # concurrent page image PUTs to Minio
+PROGRESS_MIN_INTERVAL = 0.2  # seconds between progress writes while parsing
+JOB_WORKERS = 4  # parse jobs run at once; later uploads wait as "queued"
+
+log = logging.getLogger(__name__)
+
+# Shared across parse workers so each page reuses a kept-alive connection to
+# the inference server instead of opening a new one. The transport retries
+# only failed connection attempts, which is safe for the POSTs sent here.
+_http = httpx.Client(
+    transport=httpx.HTTPTransport(
+        limits=httpx.Limits(
+            max_connections=PARSE_WORKERS * 4,
+            max_keepalive_connections=PARSE_WORKERS * 2,
+        ),
+        retries=3,
+    ),
+    timeout=httpx.Timeout(300.0, connect=10.0),
+)
+atexit.register(_http.close)
+
+# Long-lived pools shared by all jobs: job runners, per-page OCR workers
+# (which also caps concurrent requests to the inference server) and page
+# image uploads.
+_job_pool = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="parse-job")
+_page_pool = ThreadPoolExecutor(max_workers=PARSE_WORKERS, thread_name_prefix="parse")
+_upload_pool = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix="page-upload")
+
+
+def _log_job_failure(fut: Future):
+    exc = fut.exception()
+    if exc is not None:
+        log.error("Parse job failed", exc_info=exc)
 
 
 # ---------- PDF rendering ----------
@@ -29,45 +86,153 @@ def render_pdf_page(page, max_res: int = MAX_RESOLUTION, scale: float = PDF_SCAL
     return page.render(scale=scale * factor, rev_byteorder=True).to_pil()
 
 
-def render_pdf_from_bytes(pdf_bytes: bytes) -> list[Image.Image]:
-    """Render PDF pages from bytes using a temporary file."""
+def _encode_ocr_jpeg(image: Image.Image) -> bytes:
+    """Encode a page the way the vision model receives it."""
+    buf = BytesIO()
+    image.save(buf, format="JPEG", quality=90)
+    return buf.getvalue()
+
+
+def _render_page_block(pdf_path: str, start: int, stop: int) -> list[tuple[bytes, bytes]]:
+    """Render pages [start, stop) of the PDF at pdf_path to (PNG, JPEG) bytes.
+
+    Runs in a render worker process; returns bytes since they pickle far
+    more cheaply than PIL images. The PNG is stored for display, the JPEG is
+    what parse_page sends to the model.
+    """
+    pdf = pdfium.PdfDocument(pdf_path)
+    try:
+        pages = []
+        for i in range(start, stop):
+            img = render_pdf_page(pdf[i])
+            buf = BytesIO()
+            img.save(buf, format="PNG", compress_level=PAGE_PNG_COMPRESS_LEVEL)
+            pages.append((buf.getvalue(), _encode_ocr_jpeg(img)))
+        return pages
+    finally:
+        pdf.close()
+
+
+# pdfium is not thread-safe, so rendering is spread over processes. Spawned
+# rather than forked: the server process is multi-threaded.
+_render_pool: ProcessPoolExecutor | None = None
+_render_pool_lock = threading.Lock()
+
+
+def _get_render_pool() -> ProcessPoolExecutor:
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            _render_pool = ProcessPoolExecutor(
+                max_workers=RENDER_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            atexit.register(_render_pool.shutdown, wait=False, cancel_futures=True)
+        return _render_pool
+
+
+def _discard_render_pool(pool: ProcessPoolExecutor):
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is pool:
+            _render_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def pdf_page_count(pdf_bytes: bytes) -> int:
+    pdf = pdfium.PdfDocument(pdf_bytes)
+    try:
+        return len(pdf)
+    finally:
+        pdf.close()
+
+
+def render_pdf_pages(pdf_bytes: bytes) -> Iterator[tuple[bytes, bytes]]:
+    """Yield (PNG, JPEG) bytes for every page of a PDF, in page order.
+
+    Pages are rendered in blocks of RENDER_BLOCK_PAGES across the render
+    process pool; the PDF is handed over as a temporary file path. Only a
+    window of blocks is rendered ahead of the consumer, so memory stays
+    bounded however long the document is.
+    """
     with tempfile.NamedTemporaryFile(suffix=".pdf", delete=True) as tmp:
         tmp.write(pdf_bytes)
         tmp.flush()
         pdf = pdfium.PdfDocument(tmp.name)
-        images = [render_pdf_page(pdf[i]) for i in range(len(pdf))]
+        n_pages = len(pdf)
         pdf.close()
-    return images
+
+        blocks = iter([
+            (start, min(start + RENDER_BLOCK_PAGES, n_pages))
+            for start in range(0, n_pages, RENDER_BLOCK_PAGES)
+        ])
+        if n_pages <= RENDER_BLOCK_PAGES or RENDER_WORKERS <= 1:
+            for start, stop in blocks:
+                yield from _render_page_block(tmp.name, start, stop)
+            return
+
+        pool = _get_render_pool()
+        ahead: deque = deque()
+        try:
+            for start, stop in islice(blocks, RENDER_WORKERS * 2):
+                ahead.append(pool.submit(_render_page_block, tmp.name, start, stop))
+            while ahead:
+                pages = ahead.popleft().result()
+                nxt = next(blocks, None)
+                if nxt is not None:
+                    ahead.append(pool.submit(_render_page_block, tmp.name, *nxt))
+                yield from pages
+        except BrokenProcessPool:
+            # A worker died; start a fresh pool for the next job
+            _discard_render_pool(pool)
+            raise
+        finally:
+            for fut in ahead:
+                fut.cancel()
 
 
 # ---------- Vision API ----------
+# A line holding nothing but a role name, with its newline. Whitespace is
+# matched without crossing lines so blank lines around a marker survive.
+_ROLE_LINE_RE = re.compile(
+    r"^[^\S\n]*(?i:system|user|assistant)[^\S\n]*(?:\n|\Z)", re.MULTILINE
+)
+
+
 def _clean_output(text: str) -> str:
     if not text:
         return ""
-    markers = ["system", "user", "assistant"]
-    lines = text.split("\n")
-    cleaned = [l for l in lines if l.strip().lower() not in markers]
-    result = "\n".join(cleaned).strip()
-    if "assistant" in text.lower():
-        parts = text.split("assistant", 1)
-        if len(parts) > 1:
-            result = parts[1].strip()
-    return result
-
-
-def parse_page(image: Image.Image, server_url: str, max_tokens: int = 8192) -> str:
-    buf = BytesIO()
-    image.save(buf, format="JPEG", quality=90)
-    image_b64 = base64.b64encode(buf.getvalue()).decode()
-    image_uri = f"data:image/jpeg;base64,{image_b64}"
+    # Everything after an echoed "assistant" turn is the answer; only fall
+    # back to dropping bare role lines when there is none.
+    idx = text.find("assistant")
+    if idx >= 0:
+        return text[idx + len("assistant"):].strip()
+    return _ROLE_LINE_RE.sub("", text).strip()
+
+
+def _stored_page_jpeg(uid: str, page_num: int) -> bytes:
+    """Fetch a stored page image and encode it for the model."""
+    with Image.open(BytesIO(storage.get_page_image(uid, page_num))) as img:
+        return _encode_ocr_jpeg(img)
+
+
+_IMAGE_SLOT = "@@IMAGE@@"
 
+
+@lru_cache(maxsize=8)
+def _payload_template(max_tokens: int) -> tuple[bytes, bytes]:
+    """The chat request body as JSON bytes, split where the page image goes.
+
+    Everything but the image is constant, so each page only splices its
+    base64 in instead of JSON-encoding a dict holding a multi-MB string.
+    """
     payload = {
         "model": MODEL_ID,
         "messages": [
             {
                 "role": "user",
                 "content": [
-                    {"type": "image_url", "image_url": {"url": image_uri}},
+                    {"type": "image_url", "image_url": {"url": _IMAGE_SLOT}},
                 ],
             }
         ],
@@ -76,16 +241,27 @@ def parse_page(image: Image.Image, server_url: str, max_tokens: int = 8192) -> s
         "top_p": 0.9,
         "stream": False,
     }
+    head, tail = json.dumps(payload).split(_IMAGE_SLOT)
+    return (head + "data:image/jpeg;base64,").encode(), tail.encode()
+
 
-    headers = {"Authorization": f"Bearer {API_KEY}"}
-    resp = httpx.post(
+def parse_page(jpeg: bytes, server_url: str, max_tokens: int = 8192) -> str:
+    """OCR one page from JPEG bytes produced by _encode_ocr_jpeg."""
+    head, tail = _payload_template(max_tokens)
+    # base64 output is plain ASCII, so it needs no JSON escaping
+    body = b"".join((head, base64.b64encode(jpeg), tail))
+
+    headers = {
+        "Authorization": f"Bearer {API_KEY}",
+        "Content-Type": "application/json",
+    }
+    resp = _http.post(
         f"{server_url}/chat/completions",
-        json=payload,
+        content=body,
         headers=headers,
-        timeout=300.0,
     )
     resp.raise_for_status()
-    text = resp.json()["choices"][0]["message"]["content"]
+    text = json_loads(resp.content)["choices"][0]["message"]["content"]
     return _clean_output(text)
 
 
@@ -96,6 +272,7 @@ def run_parse_job(uid: str, server_url: str, app: Flask):
             from db import (
                 db_create_pages,
                 db_get,
+                db_get_pending_page_nums,
                 db_update,
                 db_update_page_done,
                 db_update_page_error,
@@ -108,78 +285,116 @@ def run_parse_job(uid: str, server_url: str, app: Flask):
 
             pdf_key = u["pdf_path"]  # Now a Minio key like "abc123.pdf"
 
-            # Step 1: Render pages as images (skip for image uploads)
+            # Step 1: Work out the pages. PDF pages are rendered as they are
+            # parsed below; image uploads are already saved to Minio.
             if pdf_key:
                 try:
                     db_update(uid, state="rendering", message="Rendering PDF pages...")
-
-                    # Download PDF from Minio and render
                     pdf_bytes = storage.get_pdf(uid)
-                    images = render_pdf_from_bytes(pdf_bytes)
-                    total = len(images)
-
-                    db_update(uid, total_pages=total, message=f"Saving {total} page images...")
-
-                    # Save page images to Minio
-                    for i, img in enumerate(images, start=1):
-                        buf = BytesIO()
-                        img.save(buf, format="PNG")
-                        storage.upload_page_image(uid, i, buf.getvalue())
-
+                    total = pdf_page_count(pdf_bytes)
+                    db_update(uid, total_pages=total, message=f"Rendering {total} pages...")
                     db_create_pages(uid, list(range(1, total + 1)))
-                    db_update(uid, message=f"Rendered {total} pages")
+                    # Page rows exist before their images are saved, so this
+                    # may be a restart of a job that stopped part way; pages
+                    # already done are only re-rendered, not parsed again.
+                    to_parse = set(db_get_pending_page_nums(uid))
                 except Exception as e:
                     db_update(uid, state="error", message=f"Render failed: {e}")
                     return
+                # (PNG for display, JPEG for the model) per page
+                pages = render_pdf_pages(pdf_bytes)
             else:
-                # Image upload — pages already saved to Minio
                 page_files = storage.list_page_images(uid)
                 total = len(page_files)
                 if total == 0:
                     db_update(uid, state="error", message="No page images found")
                     return
 
-                # Load images from Minio
-                images = []
-                for i in range(1, total + 1):
-                    img_bytes = storage.get_page_image(uid, i)
-                    images.append(Image.open(BytesIO(img_bytes)))
+                # Fetched and encoded by the parse workers
+                pages = ((None, None) for _ in range(total))
+                to_parse = set(range(1, total + 1))
 
-                db_update(uid, total_pages=total, message=f"Loaded {total} images")
+                db_update(uid, total_pages=total, message=f"Found {total} images")
 
-            # Step 2: Parse pages concurrently
+            # Step 2: Parse pages concurrently, feeding the pool as pages are
+            # rendered. At most PARSE_WORKERS * 2 pages wait in memory.
             db_update(uid, state="parsing", message=f"Starting parse ({PARSE_WORKERS} workers)...")
-            done_count = 0
-            lock = threading.Lock()
+            done_count = total - len(to_parse)
+            last_progress = 0.0
 
-            def _parse_one(page_num, img):
-                nonlocal done_count
+            def _parse_one(page_num, jpeg):
                 try:
-                    markdown = parse_page(img, server_url)
+                    if jpeg is None:
+                        jpeg = _stored_page_jpeg(uid, page_num)
+                    markdown = parse_page(jpeg, server_url)
+                    tables = extract_tables(markdown)
                     with app.app_context():
-                        db_update_page_done(uid, page_num, markdown)
+                        db_update_page_done(uid, page_num, markdown, tables)
                 except Exception as e:
                     with app.app_context():
                         db_update_page_error(uid, page_num, str(e))
-                with lock:
-                    done_count += 1
-                    with app.app_context():
-                        db_update(uid, current_page=done_count,
-                                  message=f"Parsed {done_count}/{total}")
-
-            with ThreadPoolExecutor(max_workers=PARSE_WORKERS) as pool:
-                futures = {
-                    pool.submit(_parse_one, i + 1, img): i + 1
-                    for i, img in enumerate(images)
-                }
-                for fut in as_completed(futures):
+
+            def _finished(done):
+                # Progress is written from this thread only, so workers never
+                # wait on each other and the count only moves forward. Writes
+                # are throttled; the last page always gets one.
+                nonlocal done_count, last_progress
+                for fut in done:
                     fut.result()
+                    done_count += 1
+                now = time.monotonic()
+                if now - last_progress >= PROGRESS_MIN_INTERVAL or done_count == total:
+                    last_progress = now
+                    db_update(uid, current_page=done_count,
+                              message=f"Parsed {done_count}/{total}")
+
+            def _saved(done):
+                # First failed page upload among done, if any
+                return next((f.exception() for f in done if f.exception() is not None), None)
+
+            render_error = None
+            saves = set()
+            in_flight = set()
+            numbered = enumerate(pages, start=1)
+            while render_error is None:
+                try:
+                    page_num, (png, jpeg) = next(numbered)
+                except StopIteration:
+                    break
+                except Exception as e:
+                    # Let pages already submitted finish, then report
+                    render_error = e
+                    break
+                if png is not None:
+                    # PUTs are latency-bound, so overlap them. Pages already
+                    # parsed are not throttled by in_flight, so pending PNGs
+                    # are bounded here too.
+                    saves.add(_upload_pool.submit(storage.upload_page_image, uid, page_num, png))
+                    if len(saves) >= UPLOAD_WORKERS * 2:
+                        done, saves = wait(saves, return_when=FIRST_COMPLETED)
+                        render_error = _saved(done)
+                if page_num not in to_parse:
+                    continue
+                in_flight.add(_page_pool.submit(_parse_one, page_num, jpeg))
+                if len(in_flight) >= PARSE_WORKERS * 2:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    _finished(done)
+            while in_flight:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                _finished(done)
+
+            done, _ = wait(saves)
+            if render_error is None:
+                render_error = _saved(done)
+            if render_error is not None:
+                db_update(uid, state="error", message=f"Render failed: {render_error}")
+                return
 
             db_update(uid, state="done", current_page=total,
                       message=f"Done — {total} pages parsed")
             run_auto_extract(uid)
 
-    threading.Thread(target=_run, daemon=True).start()
+    _job_pool.submit(_run).add_done_callback(_log_job_failure)
 
 
 def resume_parse_job(uid: str, server_url: str, app: Flask):
@@ -213,16 +428,20 @@ def resume_parse_job(uid: str, server_url: str, app: Flask):
                 run_parse_job(uid, server_url, app)
                 return
 
-            # Load images from Minio
-            images = {}
-            for i in range(1, total + 1):
-                if storage.page_image_exists(uid, i):
-                    img_bytes = storage.get_page_image(uid, i)
-                    images[i] = Image.open(BytesIO(img_bytes))
+            # Pages with a stored image, taken from the listing above rather
+            # than a HEAD per page; the parse workers fetch them
+            stored = set(page_files)
+            available = {i for i in range(1, total + 1) if f"page_{i:03d}.png" in stored}
 
             pending = db_get_pending_page_nums(uid)
             db_reset_error_pages(uid)
 
+            # A PDF job that stopped mid-render leaves pending pages without
+            # an image; render again, which parses only the pages not done.
+            if u["pdf_path"] and any(pn not in available for pn in pending):
+                run_parse_job(uid, server_url, app)
+                return
+
             if not pending:
                 db_update(uid, state="done", current_page=total,
                           message=f"Done — {total} pages parsed")
@@ -233,33 +452,30 @@ def resume_parse_job(uid: str, server_url: str, app: Flask):
             db_update(uid, state="parsing", current_page=already_done,
                       message=f"Resuming — {len(pending)} pages remaining...")
             done_count = already_done
-            lock = threading.Lock()
 
-            def _parse_one(page_num, img):
-                nonlocal done_count
+            def _parse_one(page_num):
                 try:
-                    markdown = parse_page(img, server_url)
+                    markdown = parse_page(_stored_page_jpeg(uid, page_num), server_url)
+                    tables = extract_tables(markdown)
                     with app.app_context():
-                        db_update_page_done(uid, page_num, markdown)
+                        db_update_page_done(uid, page_num, markdown, tables)
                 except Exception as e:
                     with app.app_context():
                         db_update_page_error(uid, page_num, str(e))
-                with lock:
-                    done_count += 1
-                    with app.app_context():
-                        db_update(uid, current_page=done_count,
-                                  message=f"Parsed {done_count}/{total}")
-
-            with ThreadPoolExecutor(max_workers=PARSE_WORKERS) as pool:
-                futures = {
-                    pool.submit(_parse_one, pn, images[pn]): pn
-                    for pn in pending if pn in images
-                }
-                for fut in as_completed(futures):
-                    fut.result()
+
+            futures = [_page_pool.submit(_parse_one, pn) for pn in pending if pn in available]
+            last_progress = 0.0
+            for fut in as_completed(futures):
+                fut.result()
+                done_count += 1
+                now = time.monotonic()
+                if now - last_progress >= PROGRESS_MIN_INTERVAL or done_count == total:
+                    last_progress = now
+                    db_update(uid, current_page=done_count,
+                              message=f"Parsed {done_count}/{total}")
 
             db_update(uid, state="done", current_page=total,
                       message=f"Done — {total} pages parsed")
             run_auto_extract(uid)
 
-    threading.Thread(target=_run, daemon=True).start()
+    _job_pool.submit(_run).add_done_callback(_log_job_failure)
@@ -0,0 +1,24 @@
+from __future__ import annotations
+
+import csv
+from collections.abc import Iterable, Iterator
+from io import StringIO
+from itertools import islice
+
+CSV_BATCH_ROWS = 1000
+
+
+def iter_csv(columns: list[str], rows: Iterable[list[str]]) -> Iterator[str]:
+    """Yield CSV text in batches of rows, reusing one small buffer."""
+    buf = StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(columns)
+    rows = iter(rows)
+    while batch := list(islice(rows, CSV_BATCH_ROWS)):
+        # writerows loops in C; one call per batch instead of per row
+        writer.writerows(batch)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate(0)
+    if buf.tell():
+        yield buf.getvalue()
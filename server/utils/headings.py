@@ -0,0 +1,13 @@
+from __future__ import annotations
+
+import re
+
+# A markdown ATX heading ("# Title"); group 1 is its text
+RE_HEADING = re.compile(r"^#+\s+(.+)", re.MULTILINE)
+
+
+def find_headings(markdown: str) -> list[str]:
+    """Text of every markdown heading, in document order."""
+    if "#" not in markdown:
+        return []
+    return RE_HEADING.findall(markdown)
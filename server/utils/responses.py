@@ -0,0 +1,33 @@
+from __future__ import annotations
+
+import json
+
+from flask import Response, jsonify
+
+try:
+    import orjson
+except ImportError:  # optional; fall back to Flask's encoder
+    orjson = None
+
+
+def json_response(obj, status: int = 200) -> Response:
+    """Serialize a (potentially large) JSON payload, using orjson when available."""
+    if orjson is None:
+        resp = jsonify(obj)
+        resp.status_code = status
+        return resp
+    return Response(orjson.dumps(obj), status=status, mimetype="application/json")
+
+
+def json_dumps(obj) -> str:
+    """Encode obj as a compact JSON string, using orjson when available."""
+    if orjson is None:
+        return json.dumps(obj, separators=(",", ":"))
+    return orjson.dumps(obj).decode()
+
+
+def json_loads(data: bytes | str):
+    """Decode JSON, using orjson when available."""
+    if orjson is None:
+        return json.loads(data)
+    return orjson.loads(data)
@@ -1,17 +1,83 @@
 from __future__ import annotations
 
 import re
+from functools import lru_cache
 
 from bs4 import BeautifulSoup
 
 
+class _ColCharMap(dict):
+    """str.translate table: word characters and '|' map to themselves, all
+    else to '_'. Filled lazily per code point since names can be any Unicode."""
+
+    def __missing__(self, cp: int) -> int | str:
+        c = chr(cp)
+        v = cp if c.isalnum() or c == "_" or c == "|" else "_"
+        self[cp] = v
+        return v
+
+
+_COL_CHARS = _ColCharMap()
+
+_RE_TABLE_OPEN = re.compile(r"<table", re.IGNORECASE)
+
+
+@lru_cache(maxsize=4096)
 def normalize_col(name: str) -> str:
     """Normalize column name for CSV export."""
-    name = name.replace("₹", "INR")
-    name = re.sub(r"\s+", "_", name.strip())
-    name = re.sub(r"[^\w|]", "_", name)
-    name = re.sub(r"_+", "_", name).strip("_").lower()
-    return name
+    name = name.replace("₹", "INR").translate(_COL_CHARS)
+    while "__" in name:
+        name = name.replace("__", "_")
+    return name.strip("_").lower()
+
+
+def _tags(nodes, name: str) -> list:
+    """The tags called name among nodes (a tag's .children or .descendants)."""
+    return [el for el in nodes if el.name == name]
+
+
+def _first_tag(tag, name: str):
+    """Same as tag.find(name), without bs4's generic matcher."""
+    return next((el for el in tag.descendants if el.name == name), None)
+
+
+def _cells(row) -> list:
+    """All <td>/<th> descendants of a row, in document order.
+
+    Same result as row.find_all(["td", "th"]) without bs4's generic matcher,
+    which dominated table parsing time.
+    """
+    return [el for el in row.descendants if el.name == "td" or el.name == "th"]
+
+
+def _column_info(grid: list[list[str | None]], n_cols: int) -> list[dict]:
+    """Column objects for a multi-row header grid, one per column."""
+    column_info = []
+    for ci in range(n_cols):
+        levels = [row[ci] or "" for row in grid]
+
+        # Deduplicate consecutive identical levels (from rowspan)
+        deduped = [levels[0]]
+        for lv in levels[1:]:
+            if lv != deduped[-1]:
+                deduped.append(lv)
+
+        if len(deduped) == 1:
+            parent = deduped[0]
+            child = ""
+            display = parent
+        else:
+            parent = deduped[0]
+            child = deduped[-1]
+            display = " | ".join(deduped)
+
+        column_info.append({
+            "parent": parent,
+            "child": child,
+            "display": display,
+            "normalized": normalize_col(display),
+        })
+    return column_info
 
 
 def _parse_table(table_tag) -> dict | None:
@@ -23,27 +89,24 @@ def _parse_table(table_tag) -> dict | None:
         display_columns: list of display column names (backward compat)
         rows:        list of list of str
     """
-    thead = table_tag.find("thead")
-    tbody = table_tag.find("tbody")
+    thead = _first_tag(table_tag, "thead")
+    tbody = _first_tag(table_tag, "tbody")
 
     if thead:
-        header_rows = thead.find_all("tr")
-        body_rows = tbody.find_all("tr") if tbody else []
+        header_rows = _tags(thead.descendants, "tr")
+        body_rows = _tags(tbody.descendants, "tr") if tbody else []
     else:
         # No <thead>: contiguous block of rows with <th> at top = headers
-        all_rows = table_tag.find_all("tr", recursive=False)
+        all_rows = _tags(table_tag.children, "tr")
         if not all_rows:
-            # Try without recursive=False (some tables nest <tr> inside implicit tbody)
-            all_rows = table_tag.find_all("tr")
+            # Try nested rows too (some tables nest <tr> inside implicit tbody)
+            all_rows = _tags(table_tag.descendants, "tr")
         header_rows = []
-        body_rows = []
-        header_done = False
         for row in all_rows:
-            if not header_done and row.find("th"):
-                header_rows.append(row)
-            else:
-                header_done = True
-                body_rows.append(row)
+            if not any(el.name == "th" for el in row.descendants):
+                break
+            header_rows.append(row)
+        body_rows = all_rows[len(header_rows):]
         # If no <th> found, treat first row as header
         if not header_rows and all_rows:
             header_rows = [all_rows[0]]
@@ -53,14 +116,12 @@ def _parse_table(table_tag) -> dict | None:
         return None
 
     n_header_rows = len(header_rows)
+    header_cells = [_cells(row) for row in header_rows]
+    # Parsed once here; also needed for the column count
+    header_spans = [[int(cell.get("colspan", 1)) for cell in cells] for cells in header_cells]
 
     # Determine number of columns from header rows
-    n_cols = 0
-    for row in header_rows:
-        count = 0
-        for cell in row.find_all(["th", "td"]):
-            count += int(cell.get("colspan", 1))
-        n_cols = max(n_cols, count)
+    n_cols = max(0, *map(sum, header_spans))
 
     if n_cols == 0:
         return None
@@ -68,9 +129,9 @@ def _parse_table(table_tag) -> dict | None:
     # Build header grid (n_header_rows x n_cols)
     grid: list[list[str | None]] = [[None] * n_cols for _ in range(n_header_rows)]
 
-    for ri, row in enumerate(header_rows):
+    for ri, (cells, spans) in enumerate(zip(header_cells, header_spans)):
         ci = 0
-        for cell in row.find_all(["th", "td"]):
+        for cell, cs in zip(cells, spans):
             # Advance past cells already filled by rowspan from above
             while ci < n_cols and grid[ri][ci] is not None:
                 ci += 1
@@ -79,68 +140,50 @@ def _parse_table(table_tag) -> dict | None:
 
             text = cell.get_text(strip=True)
             rs = int(cell.get("rowspan", 1))
-            cs = int(cell.get("colspan", 1))
 
-            for dr in range(rs):
-                for dc in range(cs):
-                    r, c = ri + dr, ci + dc
-                    if r < n_header_rows and c < n_cols:
-                        grid[r][c] = text
+            # Fill the spanned block a row slice at a time, clipped to the grid
+            end = min(ci + cs, n_cols)
+            if end > ci:
+                fill = [text] * (end - ci)
+                for r in range(ri, min(ri + rs, n_header_rows)):
+                    grid[r][ci:end] = fill
             ci += cs
 
     # Build column objects from header grid
-    column_info = []
-    for ci in range(n_cols):
-        levels = []
-        for ri in range(n_header_rows):
-            val = grid[ri][ci] or ""
-            levels.append(val)
-
-        # Deduplicate consecutive identical levels (from rowspan)
-        deduped = [levels[0]]
-        for lv in levels[1:]:
-            if lv != deduped[-1]:
-                deduped.append(lv)
-
-        if len(deduped) == 1:
-            parent = deduped[0]
-            child = ""
-            display = parent
-        else:
-            parent = deduped[0]
-            child = deduped[-1]
-            display = " | ".join(deduped)
-
-        column_info.append({
-            "parent": parent,
-            "child": child,
-            "display": display,
-            "normalized": normalize_col(display),
-        })
+    if n_header_rows == 1:
+        # Flat header (the common case): each label is its own display name
+        column_info = [
+            {"parent": val, "child": "", "display": val, "normalized": normalize_col(val)}
+            for val in (v or "" for v in grid[0])
+        ]
+    else:
+        column_info = _column_info(grid, n_cols)
 
     # Parse data rows with rowspan tracking
     rows: list[list[str]] = []
-    active_spans: dict[int, tuple[str, int]] = {}  # col -> (value, remaining)
+    # Rowspans carried down from earlier rows: per column, the value to repeat
+    # and how many more rows it covers.
+    span_val: list[str] = ["-"] * n_cols
+    span_rem: list[int] = [0] * n_cols
 
     for row in body_rows:
-        cells = row.find_all(["td", "th"])
-        out_row = [""] * n_cols
+        cells = _cells(row)
+        n_cells = len(cells)
+        # Empty cells are exported as "-"; fill that in as we go rather than
+        # rebuilding the row afterwards.
+        out_row = ["-"] * n_cols
         ci = 0
         cell_idx = 0
 
         while ci < n_cols:
             # Check active rowspan from previous rows
-            if ci in active_spans:
-                val, remaining = active_spans[ci]
-                out_row[ci] = val
-                if remaining <= 1:
-                    del active_spans[ci]
-                else:
-                    active_spans[ci] = (val, remaining - 1)
+            if span_rem[ci]:
+                out_row[ci] = span_val[ci]
+                span_rem[ci] -= 1
                 ci += 1
                 continue
 
-            if cell_idx >= len(cells):
+            if cell_idx >= n_cells:
                 ci += 1
                 continue
 
@@ -149,17 +192,17 @@ def _parse_table(table_tag) -> dict | None:
             rs = int(cell.get("rowspan", 1))
             cs = int(cell.get("colspan", 1))
 
-            for dc in range(cs):
-                if ci + dc < n_cols:
-                    out_row[ci + dc] = text
-                    if rs > 1:
-                        active_spans[ci + dc] = (text, rs - 1)
+            end = min(ci + cs, n_cols)
+            if end > ci:
+                fill = [text or "-"] * (end - ci)
+                out_row[ci:end] = fill
+                if rs > 1:
+                    span_val[ci:end] = fill
+                    span_rem[ci:end] = [rs - 1] * (end - ci)
 
             ci += cs
             cell_idx += 1
 
-        # Replace empty strings with "-"
-        out_row = [v if v else "-" for v in out_row]
         rows.append(out_row)
 
     return {
@@ -194,7 +237,8 @@ def group_columns_by_parent(columns: list[dict]) -> list[dict]:
 
 def extract_tables(markdown: str) -> list[dict]:
     """Extract HTML tables from markdown, return structured data with parent/child columns."""
-    if not markdown:
+    # Most pages are prose; skip building a soup when no table tag can exist.
+    if not markdown or not _RE_TABLE_OPEN.search(markdown):
         return []
 
     soup = BeautifulSoup(markdown, "html.parser")